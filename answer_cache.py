@@ -0,0 +1,297 @@
+"""Cache of final answers by user question.
+
+A question is looked up by its normalized text first, then among near-duplicates:
+MinHash LSH over character n-grams finds candidates, and a candidate counts only
+if it has the same words in the same order up to case, punctuation, filler words
+and single typos in long words. Numbers and names must match exactly, so
+"сколько букв r" and "сколько букв s", "17 минус 23" and "23 минус 17" or
+"Иванов" and "Иванова" do not share an answer.
+
+Only first questions of a conversation are cached: follow-ups depend on the history.
+Answers built on search results expire after ANSWER_CACHE_SEARCH_TTL, the rest
+after ANSWER_CACHE_TTL. The near-duplicate index lives in memory and holds at
+most ANSWER_CACHE_MAX_SIZE questions, like the cache. With the SQLite backend it
+is rebuilt from the table at startup, so only answers other processes store
+later are found by exact match only.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Optional
+
+from cache import BaseCache, make_cache
+
+ANSWER_CACHE = make_cache(
+    "ANSWER_CACHE",
+    default_path="answer_cache.sqlite",
+    default_ttl=7 * 24 * 3600,
+    default_backend="none",
+)
+# Search results go stale much sooner than general knowledge
+ANSWER_CACHE_SEARCH_TTL = float(os.getenv("ANSWER_CACHE_SEARCH_TTL", "3600"))
+# Minimal Jaccard similarity of character n-grams for a near-duplicate
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.7"))
+
+NGRAM = 3
+# 16 bands of 4 rows find pairs with n-gram Jaccard above ~0.5 with high probability
+LSH_BANDS = 16
+LSH_ROWS = 4
+
+FILLER_WORDS = {"а", "и", "ну", "же", "ли", "пожалуйста", "скажи", "подскажи"}
+
+_TOKEN_RE = re.compile(r"\w+|[.!?]")
+_PRIME = (1 << 61) - 1
+_SEEDS = [
+    (
+        int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], "big") | 1,
+        int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], "big"),
+    )
+    for i in range(LSH_BANDS * LSH_ROWS)
+]
+
+
+def question_words(question: str) -> list:
+    """(word, exact) pairs of the question without filler words.
+
+    `exact` marks words that a typo must not change: numbers and names, i.e.
+    capitalized words that do not start a sentence.
+    """
+    words = []
+    sentence_start = True
+    for token in _TOKEN_RE.findall(question.replace("ё", "е").replace("Ё", "Е")):
+        if token in ".!?":
+            sentence_start = True
+            continue
+        word = token.lower()
+        if word not in FILLER_WORDS:
+            exact = any(char.isdigit() for char in token) or (
+                token[0].isupper() and not sentence_start
+            )
+            words.append((word, exact))
+        sentence_start = False
+    return words
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(word for word, _ in question_words(question))
+
+
+def ngrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i : i + NGRAM] for i in range(max(1, len(padded) - NGRAM + 1))}
+
+
+def minhash(grams: set) -> list:
+    hashes = [
+        int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=8).digest(), "big")
+        for gram in grams
+    ]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _SEEDS]
+
+
+def _one_typo(a: str, b: str) -> bool:
+    """Whether the words differ by a single insertion, deletion or substitution."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i + (len(a) == len(b)) :] == b[i + 1 :]
+
+
+def same_words(first: str, second: str) -> bool:
+    """Whether two questions have the same words in the same order.
+
+    A word may differ by a single typo if it is long and neither side marks it
+    as exact (see `question_words`).
+    """
+    words_a, words_b = question_words(first), question_words(second)
+    if len(words_a) != len(words_b):
+        return False
+    for (a, exact_a), (b, exact_b) in zip(words_a, words_b):
+        if a == b:
+            continue
+        if exact_a or exact_b or len(a) < 5 or len(b) < 5 or not _one_typo(a, b):
+            return False
+    return True
+
+
+class AnswerIndex:
+    """MinHash LSH over normalized questions, dropping the least recently used."""
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self._buckets = defaultdict(set)
+        # question -> (n-grams, LSH bucket keys), in LRU order
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, question: str):
+        grams = ngrams(question)
+        signature = minhash(grams)
+        bands = [
+            (band, tuple(signature[band * LSH_ROWS : (band + 1) * LSH_ROWS]))
+            for band in range(LSH_BANDS)
+        ]
+        with self._lock:
+            self._remove(question)
+            self._entries[question] = (grams, bands)
+            for bucket in bands:
+                self._buckets[bucket].add(question)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def touch(self, question: str):
+        with self._lock:
+            if question in self._entries:
+                self._entries.move_to_end(question)
+
+    def remove(self, question: str):
+        with self._lock:
+            self._remove(question)
+
+    def _remove(self, question: str):
+        entry = self._entries.pop(question, None)
+        if entry is None:
+            return
+        for bucket in entry[1]:
+            members = self._buckets[bucket]
+            members.discard(question)
+            if not members:
+                del self._buckets[bucket]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def similar(self, question: str) -> list:
+        """Indexed questions passing the similarity threshold, most similar first."""
+        grams = ngrams(question)
+        signature = minhash(grams)
+        with self._lock:
+            candidates = set()
+            for band in range(LSH_BANDS):
+                rows = tuple(signature[band * LSH_ROWS : (band + 1) * LSH_ROWS])
+                candidates |= self._buckets.get((band, rows), set())
+            scored = [
+                (
+                    len(grams & self._entries[other][0])
+                    / len(grams | self._entries[other][0]),
+                    other,
+                )
+                for other in candidates
+            ]
+        return [
+            other
+            for score, other in sorted(scored, reverse=True)
+            if score >= ANSWER_CACHE_SIMILARITY
+        ]
+
+
+class AnswerCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.lookup_seconds = 0.0
+
+    def record(self, outcome: str, seconds: float):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.lookup_seconds += seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.near_hits + self.misses
+            return {
+                "lookups": lookups,
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": (
+                    (self.exact_hits + self.near_hits) / lookups if lookups else 0.0
+                ),
+                "avg_lookup_ms": (
+                    1000 * self.lookup_seconds / lookups if lookups else 0.0
+                ),
+            }
+
+
+def build_index(cache: Optional[BaseCache]) -> AnswerIndex:
+    """Index of the questions already in the cache: a SQLite cache outlives the process."""
+    if cache is None:
+        return AnswerIndex(0)
+    index = AnswerIndex(cache.max_size)
+    for question in cache.keys():
+        index.add(question)
+    return index
+
+
+ANSWER_INDEX = build_index(ANSWER_CACHE)
+ANSWER_CACHE_STATS = AnswerCacheStats()
+
+
+def _fresh(entry: Optional[dict]) -> bool:
+    return entry is not None and not (
+        entry["search"] and time.time() - entry["created"] > ANSWER_CACHE_SEARCH_TTL
+    )
+
+
+def lookup(question: str) -> Optional[dict]:
+    """Cached entry ({"question", "answer", "search", "created"}) for the question or None."""
+    if ANSWER_CACHE is None:
+        return None
+    start = time.perf_counter()
+    normalized = normalize_question(question)
+    entry = ANSWER_CACHE.get(normalized)
+    outcome = "exact_hits"
+    if entry is not None:
+        ANSWER_INDEX.touch(normalized)
+    else:
+        outcome = "near_hits"
+        for other in ANSWER_INDEX.similar(normalized):
+            entry = ANSWER_CACHE.get(other)
+            if entry is None:
+                # Evicted or expired in the cache
+                ANSWER_INDEX.remove(other)
+                continue
+            # Names and numbers are told apart by the original text of the questions
+            if same_words(question, entry["question"]):
+                ANSWER_INDEX.touch(other)
+                break
+            entry = None
+    if entry is not None and not _fresh(entry):
+        ANSWER_CACHE_STATS.record("stale", 0.0)
+        entry = None
+    if entry is None:
+        outcome = "misses"
+    ANSWER_CACHE_STATS.record(outcome, time.perf_counter() - start)
+    return entry
+
+
+def store(question: str, answer: str, used_search: bool):
+    if ANSWER_CACHE is None or not answer:
+        return
+    normalized = normalize_question(question)
+    ANSWER_CACHE.set(
+        normalized,
+        {
+            "question": question,
+            "answer": answer,
+            "search": used_search,
+            "created": time.time(),
+        },
+    )
+    ANSWER_INDEX.add(normalized)
+
+
+def get_answer_cache_stats() -> dict:
+    return ANSWER_CACHE_STATS.as_dict()
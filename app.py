@@ -3,15 +3,21 @@ from dotenv import load_dotenv
 import streamlit as st
 from langchain_core.messages import AIMessage, HumanMessage
 import asyncio
+import uuid
 
-from astream_events_handler import invoke_our_graph   # Utility function to handle events from astream_events from graph
-
+# Settings are read from the environment at import time, so .env goes first
 load_dotenv()
 
+from astream_events_handler import invoke_our_graph   # Utility function to handle events from astream_events from graph
+
 st.title("GigaChat Agentic Reasoner 🤔")
 prompt = st.chat_input()
 
-st.markdown("### История разговора не хранится! Один вопрос - один ответ!")
+# Each conversation is a graph thread: its history and unfinished runs are kept by the checkpointer
+new_dialog = st.button("Новый диалог")
+if new_dialog or "thread_id" not in st.session_state:
+    st.session_state["thread_id"] = str(uuid.uuid4())
+    st.session_state["messages"] = []
 
 # Initialize chat messages in session state
 if "messages" not in st.session_state:
@@ -32,5 +38,9 @@ if prompt:
 
     with st.chat_message("assistant"):
         placeholder = st.container()
-        response = asyncio.run(invoke_our_graph(st.session_state.messages, placeholder))
+        response = asyncio.run(
+            invoke_our_graph(
+                st.session_state.messages, placeholder, st.session_state.thread_id
+            )
+        )
         st.session_state.messages.append(AIMessage(response))
@@ -1,73 +1,240 @@
+import os
+import time
+
 from langchain_core.messages import AIMessage
 import streamlit as st
 from graph import graph_runnable
 from langgraph.graph import START, END
+from answer_cache import lookup, store
+from sessions import record_turn, session_input, thread_config
+from final_answer import FINAL_ANSWER_EVENT
+from speculation import SPECULATIVE_DRAFT_RUN, SPECULATIVE_TAG
+from self_consistency import SELF_CONSISTENCY_TAG
 
+# Tokens are buffered and the UI is refreshed at most every FLUSH_INTERVAL seconds,
+# or earlier once FLUSH_CHARS characters are waiting
+FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.1"))
+FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "2000"))
 
-async def invoke_our_graph(st_messages, st_placeholder):
-    """
-    Asynchronously processes a stream of events from the graph_runnable and updates the Streamlit interface.
+FINAL_NODE = "🏁 finalizing"
+CACHED_ANSWER_PANEL = "🏁 finalizing (cached)"
 
-    Args:
-        st_messages (list): List of messages to be sent to the graph_runnable.
-        st_placeholder (st.beta_container): Streamlit placeholder used to display updates and statuses.
 
-    Returns:
-        AIMessage: An AIMessage object containing the final aggregated text content from the events.
+class NodePanel:
+    """Transcript segment of one node run, rendered into its own placeholder."""
+
+    def __init__(self, node, placeholder):
+        self.node = node
+        self.placeholder = placeholder
+        self.text = ""
+        self.pending = []
+        self.pending_chars = 0
+        self.rendered = False
+
+    def add(self, chunk):
+        self.pending.append(chunk)
+        self.pending_chars += len(chunk)
+
+    def flush(self):
+        if not self.pending and self.rendered:
+            return
+        self.text += "".join(self.pending)
+        self.pending = []
+        self.pending_chars = 0
+        self.rendered = True
+        self.placeholder.write(self.render())
+
+    def render(self):
+        return f"""
+
+<{self.node}>
+
+{self.text}
+<\\{self.node}>
+
+"""
+
+
+class StreamRenderer:
+    """Renders astream_events of the graph into per-node panels with rate-limited flushes.
+
+    Only the panel of the running node is updated, so the cost of a flush does not
+    grow with the whole transcript.
     """
-    # Set up placeholders for displaying updates in the Streamlit app
-    container = st_placeholder  # This container will hold the dynamic Streamlit UI components
-    thoughts_placeholder = container.container()  # Container for displaying status messages
-    token_placeholder = container.empty()  # Placeholder for displaying progressive token updates
-    final_text = ""  # Will store the accumulated text from the model's response
-    last_node = None
-
-    # Stream events from the graph_runnable asynchronously
-    async for event in graph_runnable.astream_events({"messages": st_messages}, version="v2"):
+
+    def __init__(
+        self,
+        container,
+        flush_interval=FLUSH_INTERVAL,
+        flush_chars=FLUSH_CHARS,
+        clock=time.monotonic,
+    ):
+        self.thoughts_placeholder = (
+            container.container()
+        )  # Container for displaying status messages
+        self.panels_container = (
+            container.container()
+        )  # Node panels go below the tool statuses
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.clock = clock
+        self.panels = []
+        self.panel = None
+        self.last_node = None
+        self.last_flush = clock()
+        self.output_placeholder = None
+        self.final_state = {}
+
+    def open_panel(self, node):
+        self.close_panel()
+        self.panel = NodePanel(node, self.panels_container.empty())
+        self.panels.append(self.panel)
+
+    def close_panel(self):
+        if self.panel is not None:
+            self.panel.flush()
+            self.panel = None
+
+    def maybe_flush(self):
+        now = self.clock()
+        if (
+            self.panel.pending_chars >= self.flush_chars
+            or now - self.last_flush >= self.flush_interval
+        ):
+            self.panel.flush()
+            self.last_flush = now
+
+    def on_event(self, event):
         kind = event["event"]  # Determine the type of event received
 
-        node = event['metadata'].get('langgraph_node', None)
-        if last_node != node:
-            if last_node not in [START, END, None, "None"]:
-                final_text += f"""
-<\{last_node}>
+        if SPECULATIVE_TAG in event.get("tags", []):
+            # The speculative draft streams concurrently with the router, so it is shown once it is complete
+            if kind == "on_chain_end" and event["name"] == SPECULATIVE_DRAFT_RUN:
+                node = self.last_node
+                self.open_panel("👨 answering (speculative)")
+                self.panel.add(str(event["data"].get("output", "")))
+                self.close_panel()
+                if node not in [START, END, None, "None"]:
+                    self.open_panel(node)
+            return
 
-"""
-            if node not in [START, END, None, "None"]:
-                final_text += f"""
+        if SELF_CONSISTENCY_TAG in event.get("tags", []):
+            # Parallel drafts would interleave their tokens; the answer node emits the winner
+            return
 
-<{node}>
+        if kind == "on_chain_end" and not event.get("parent_ids"):
+            # The end of the graph run itself carries its final state
+            self.final_state = event["data"].get("output") or {}
 
-"""
-        last_node = node
+        node = event["metadata"].get("langgraph_node", None)
+        if self.last_node != node:
+            if node not in [START, END, None, "None"]:
+                self.open_panel(node)
+            else:
+                self.close_panel()
+        self.last_node = node
 
         if kind == "on_chat_model_stream":
             # The event corresponding to a stream of new content (tokens or chunks of text)
             addition = event["data"]["chunk"].content  # Extract the new content chunk
-            final_text += addition  # Append the new content to the accumulated text
-            if addition:
-                token_placeholder.write(final_text)  # Update the st placeholder with the progressive response
+            if addition and self.panel is not None:
+                self.panel.add(addition)
+                self.maybe_flush()
+
+        elif kind == "on_custom_event" and event["name"] == FINAL_ANSWER_EVENT:
+            # An approved draft returned without the finalizer rewrite, or the winning self-consistency draft
+            if self.panel is not None:
+                self.panel.add(event["data"]["chunk"])
+                self.maybe_flush()
 
         elif kind == "on_tool_start":
             # The event signals that a tool is about to be called
-            with thoughts_placeholder:
+            with self.thoughts_placeholder:
                 status_placeholder = st.empty()  # Placeholder to show the tool's status
                 with status_placeholder.status("Calling Tool...", expanded=True) as s:
-                    st.write("Called ", event['name'])  # Show which tool is being called
+                    st.write(
+                        "Called ", event["name"]
+                    )  # Show which tool is being called
                     st.write("Tool input: ")
-                    st.code(event['data'].get('input'))  # Display the input data sent to the tool
+                    st.code(
+                        event["data"].get("input")
+                    )  # Display the input data sent to the tool
                     st.write("Tool output: ")
-                    output_placeholder = st.empty()  # Placeholder for tool output that will be updated later below
-                    s.update(label="Completed Calling Tool!", expanded=False)  # Update the status once done
+                    self.output_placeholder = (
+                        st.empty()
+                    )  # Placeholder for tool output that will be updated later below
+                    s.update(
+                        label="Completed Calling Tool!", expanded=False
+                    )  # Update the status once done
 
         elif kind == "on_tool_end":
             # The event signals the completion of a tool's execution
-            with thoughts_placeholder:
+            with self.thoughts_placeholder:
                 # We assume that `on_tool_end` comes after `on_tool_start`, meaning output_placeholder exists
-                if 'output_placeholder' in locals():
-                    output_placeholder.code(event['data'].get('output').content)  # Display the tool's output
-        elif kind == "on_chain_start":
-            pass
+                if self.output_placeholder is not None:
+                    self.output_placeholder.code(
+                        event["data"].get("output").content
+                    )  # Display the tool's output
+
+    def close(self):
+        """Flushes the buffers and returns the whole transcript."""
+        self.close_panel()
+        return "".join(panel.render() for panel in self.panels)
+
+
+async def render_events(events, st_placeholder, **kwargs):
+    renderer = StreamRenderer(st_placeholder, **kwargs)
+    async for event in events:
+        renderer.on_event(event)
+    return renderer.close()
+
+
+async def invoke_our_graph(st_messages, st_placeholder, thread_id=None):
+    """
+    Asynchronously processes a stream of events from the graph_runnable and updates the Streamlit interface.
+
+    Args:
+        st_messages (list): List of messages of the conversation, the last one is the new question.
+        st_placeholder (st.beta_container): Streamlit placeholder used to display updates and statuses.
+        thread_id (str): Conversation id; the graph keeps the history of the thread and resumes
+            an interrupted run of the same question.
+
+    Returns:
+        str: The final aggregated text content from the events.
+    """
+    question = st_messages[-1].content
+    config = None
+    if thread_id is not None and graph_runnable.checkpointer is not None:
+        config = thread_config(thread_id)
+
+    # Follow-up questions depend on the conversation, so only the first one is cached
+    first_question = len(st_messages) == 1
+    if first_question:
+        cached = lookup(question)
+        if cached is not None:
+            if config is not None:
+                await record_turn(
+                    graph_runnable, config, question, cached["answer"], FINAL_NODE
+                )
+            renderer = StreamRenderer(st_placeholder)
+            renderer.open_panel(CACHED_ANSWER_PANEL)
+            renderer.panel.add(cached["answer"])
+            return renderer.close()
+
+    graph_input = {"messages": st_messages[-1:]}
+    if config is not None:
+        graph_input = await session_input(graph_runnable, config, st_messages[-1])
+
+    renderer = StreamRenderer(st_placeholder)
+    async for event in graph_runnable.astream_events(graph_input, config, version="v2"):
+        renderer.on_event(event)
+    transcript = renderer.close()
 
-    # Return the final aggregated message after all events have been processed
-    return final_text
\ No newline at end of file
+    messages = renderer.final_state.get("messages") or []
+    if first_question and messages and isinstance(messages[-1], AIMessage):
+        store(
+            question,
+            messages[-1].content,
+            used_search=bool(renderer.final_state.get("search_results")),
+        )
+    return transcript
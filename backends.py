@@ -0,0 +1,223 @@
+"""Shared guard for calls to remote backends (GigaChat, Tavily).
+
+Each backend gets a token bucket, a cap on requests in flight, jittered exponential
+retry of transient errors and a circuit breaker. Settings come from env vars with
+the backend prefix, e.g. TAVILY_RPS, TAVILY_MAX_IN_FLIGHT, TAVILY_RETRIES.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class BackendUnavailable(Exception):
+    """The circuit breaker of the backend is open."""
+
+
+def make_rate_limiter(requests_per_second: Optional[str]):
+    """Token bucket shared by all clients of a backend; None when no limit is set."""
+    if not requests_per_second:
+        return None
+    rps = float(requests_per_second)
+    return InMemoryRateLimiter(
+        requests_per_second=rps,
+        check_every_n_seconds=min(0.1, 1 / rps),
+        max_bucket_size=max(1.0, rps),
+    )
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of an error raised by httpx or gigachat, if any."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    # gigachat.exceptions.ResponseError(url, status_code, content, headers)
+    if type(error).__name__ == "ResponseError" and len(error.args) > 1:
+        return error.args[1]
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    return status_code(error) in RETRYABLE_STATUS
+
+
+class Backend:
+    """Rate limit, concurrency cap, retry and circuit breaker of one backend.
+
+    After `failure_threshold` consecutive transient failures the breaker opens and
+    calls fail with BackendUnavailable for `cooldown` seconds. Then calls go through
+    again; one more failure reopens it, a success closes it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate_limiter=None,
+        max_in_flight: int = 8,
+        retries: int = 2,
+        backoff: float = 0.5,
+        backoff_max: float = 8.0,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.rate_limiter = rate_limiter
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0}
+        self._lock = threading.Lock()
+        # asyncio primitives are bound to a loop, and Streamlit runs each question in a new one
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        return semaphore
+
+    def available(self) -> bool:
+        with self._lock:
+            return (
+                self.opened_at is None or self.clock() - self.opened_at >= self.cooldown
+            )
+
+    def _check(self):
+        if not self.available():
+            with self._lock:
+                self.counters["rejected"] += 1
+            raise BackendUnavailable(f"{self.name} is unavailable")
+
+    def _success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def _failure(self, error: BaseException):
+        with self._lock:
+            self.counters["failures"] += 1
+            if not is_retryable(error):
+                # A bad request says nothing about the health of the backend
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("%s circuit opened after %r", self.name, error)
+                self.opened_at = self.clock()
+
+    def _delay(self, attempt: int) -> float:
+        # Full jitter keeps retrying clients from hitting the backend in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2**attempt))
+
+    async def _retry_or_raise(self, error: BaseException, attempt: int):
+        self._failure(error)
+        if attempt >= self.retries or not is_retryable(error):
+            raise error
+        self._check()
+        with self._lock:
+            self.counters["retries"] += 1
+        await asyncio.sleep(self._delay(attempt))
+
+    @asynccontextmanager
+    async def _slot(self):
+        self._check()
+        async with self._semaphore():
+            self._check()
+            with self._lock:
+                self.counters["calls"] += 1
+            yield
+
+    async def _acquire(self):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire()
+
+    async def call(self, fn, *args, **kwargs):
+        """Awaits `fn(*args, **kwargs)` under the backend's limits, retrying transient errors."""
+        async with self._slot():
+            attempt = 0
+            while True:
+                await self._acquire()
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as error:
+                    await self._retry_or_raise(error, attempt)
+                    attempt += 1
+                    continue
+                self._success()
+                return result
+
+    async def stream(self, fn, *args, **kwargs):
+        """Iterates `fn(*args, **kwargs)` under the backend's limits.
+
+        A stream is retried only until its first item: consumers have already
+        seen the items yielded before a later failure.
+        """
+        async with self._slot():
+            attempt = 0
+            while True:
+                await self._acquire()
+                started = False
+                try:
+                    async for item in fn(*args, **kwargs):
+                        started = True
+                        yield item
+                except Exception as error:
+                    if started:
+                        self._failure(error)
+                        raise
+                    await self._retry_or_raise(error, attempt)
+                    attempt += 1
+                    continue
+                self._success()
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "consecutive_failures": self.failures,
+                "open": self.opened_at is not None
+                and self.clock() - self.opened_at < self.cooldown,
+            }
+
+
+def make_backend(prefix: str, **defaults) -> Backend:
+    """Backend configured from <prefix>_RPS, _MAX_IN_FLIGHT, _RETRIES, _BACKOFF,
+    _BACKOFF_MAX, _BREAKER_THRESHOLD and _BREAKER_COOLDOWN."""
+
+    def setting(name, cast, default):
+        value = os.getenv(f"{prefix}_{name}")
+        return cast(value) if value else defaults.get(name.lower(), default)
+
+    return Backend(
+        prefix.lower(),
+        rate_limiter=make_rate_limiter(os.getenv(f"{prefix}_RPS")),
+        max_in_flight=setting("MAX_IN_FLIGHT", int, 8),
+        retries=setting("RETRIES", int, 2),
+        backoff=setting("BACKOFF", float, 0.5),
+        backoff_max=setting("BACKOFF_MAX", float, 8.0),
+        failure_threshold=setting("BREAKER_THRESHOLD", int, 5),
+        cooldown=setting("BREAKER_COOLDOWN", float, 30.0),
+    )
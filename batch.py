@@ -0,0 +1,244 @@
+"""Batch run of the reasoning graph over a JSONL file of questions.
+
+Each input line is {"id": ..., "question": ...} (the line number is used when
+there is no id). Results are appended to the output JSONL as soon as each
+question finishes, and ids already answered there are skipped, so an
+interrupted batch continues where it stopped. Checkpoint threads are named after
+the output file (or --run-id), so another run of the same ids starts from scratch.
+
+    python batch.py questions.jsonl results.jsonl --concurrency 16 --llm-rps 5 --search-rps 10
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+CRITIQUE_NODE = "👨‍⚖️ self-criticque"
+FIRST_STEP_NODE = "1️⃣ first step think"
+FINAL_NODE = "🏁 finalizing"
+# Decision of the router by the node it sent the run to
+ROUTES = {
+    FINAL_NODE: "finalize",
+    "🔍 Searcher": "search",
+    "👨 answering": "writer",
+    # A speculative draft goes straight to the critic
+    CRITIQUE_NODE: "writer",
+}
+
+
+async def run_question(question: str, config: dict = None) -> dict:
+    """Runs the graph once and collects the answer and metrics from its event stream.
+
+    With a checkpointer and a thread in `config`, an interrupted run of the same
+    question is resumed instead of started over.
+    """
+    # Imported here so the CLI can set rate limits in the environment first
+    from langchain_core.messages import HumanMessage
+
+    from answer_cache import lookup, store
+    from context_budget import estimate_tokens
+    from graph import graph, graph_runnable
+    from sessions import has_history, record_turn, session_input
+
+    nodes = set(graph.nodes)
+    starts = {}
+    node_latency = defaultdict(float)
+    path = []
+    llm_calls = 0
+    prompt_tokens = 0
+    final_state = {}
+
+    graph_input = {"messages": [HumanMessage(content=question)]}
+    # Only first questions of a thread are cached: follow-ups depend on the history
+    first_turn = True
+    if config is not None and graph_runnable.checkpointer is not None:
+        first_turn = not await has_history(graph_runnable, config)
+        graph_input = await session_input(
+            graph_runnable, config, HumanMessage(content=question)
+        )
+
+    start = time.perf_counter()
+    # A resumed run has already paid for its first nodes, so it is not looked up
+    cached = lookup(question) if graph_input is not None and first_turn else None
+    if cached is not None:
+        if config is not None and graph_runnable.checkpointer is not None:
+            await record_turn(
+                graph_runnable, config, question, cached["answer"], FINAL_NODE
+            )
+        return {
+            "answer": cached["answer"],
+            "route": "cached",
+            "latency": time.perf_counter() - start,
+            "node_latency": {},
+            "path": [],
+            "llm_calls": 0,
+            "prompt_tokens": 0,
+            "critique_iterations": 0,
+            "stopped_early": None,
+        }
+
+    async for event in graph_runnable.astream_events(graph_input, config, version="v2"):
+        kind = event["event"]
+        if event["name"] in nodes and kind == "on_chain_start":
+            starts[event["run_id"]] = time.perf_counter()
+            path.append(event["name"])
+        elif event["name"] in nodes and kind == "on_chain_end":
+            node_start = starts.pop(event["run_id"], None)
+            if node_start is not None:
+                node_latency[event["name"]] += time.perf_counter() - node_start
+        elif kind == "on_chat_model_start":
+            llm_calls += 1
+            for batch in event["data"]["input"]["messages"]:
+                prompt_tokens += sum(
+                    estimate_tokens(str(message.content)) for message in batch
+                )
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            final_state = event["data"].get("output") or {}
+
+    messages = final_state.get("messages") or []
+    if messages and first_turn:
+        store(
+            question,
+            messages[-1].content,
+            used_search=bool(final_state.get("search_results")),
+        )
+    stopped = next(
+        (
+            message.artifact["stopped"]
+            for message in reversed(messages)
+            if isinstance(getattr(message, "artifact", None), dict)
+            and "stopped" in message.artifact
+        ),
+        None,
+    )
+    route = None
+    if FIRST_STEP_NODE in path[:-1]:
+        route = ROUTES.get(path[path.index(FIRST_STEP_NODE) + 1])
+    return {
+        "answer": messages[-1].content if messages else None,
+        "route": route,
+        "latency": time.perf_counter() - start,
+        "node_latency": dict(node_latency),
+        "path": path,
+        "llm_calls": llm_calls,
+        "prompt_tokens": prompt_tokens,
+        "critique_iterations": path.count(CRITIQUE_NODE),
+        # Why the answer/critique loop ended before the critique limit, if it did
+        "stopped_early": stopped,
+    }
+
+
+def read_questions(path: str):
+    with open(path) as f:
+        for number, line in enumerate(f):
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault("id", number)
+                yield item
+
+
+def completed_ids(path: str) -> set:
+    """Ids with a successful result in the output file."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {
+            str(result["id"])
+            for result in map(json.loads, filter(str.strip, f))
+            if "error" not in result
+        }
+
+
+def default_run_id(output_path: str) -> str:
+    """Run id of a batch writing to the output file: resuming it appends to the same file."""
+    path = os.path.abspath(output_path)
+    return hashlib.sha256(path.encode()).hexdigest()[:12]
+
+
+async def run_batch(
+    input_path: str, output_path: str, concurrency: int, run_id: str = None
+):
+    from sessions import thread_config
+
+    run_id = run_id or default_run_id(output_path)
+
+    done = completed_ids(output_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    counts = {"ok": 0, "failed": 0, "skipped": 0}
+    start = time.perf_counter()
+
+    with open(output_path, "a") as output:
+
+        async def process(item):
+            try:
+                # The id doubles as the thread, so a question interrupted by a crash resumes;
+                # the run id keeps the threads of other runs from becoming its history
+                config = thread_config(f"batch-{run_id}-{item['id']}")
+                result = {"id": item["id"], "question": item["question"]}
+                try:
+                    result.update(await run_question(item["question"], config))
+                    counts["ok"] += 1
+                except Exception as e:
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    counts["failed"] += 1
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                elapsed = time.perf_counter() - start
+                print(
+                    f"\rok {counts['ok']}, failed {counts['failed']}, "
+                    f"skipped {counts['skipped']}, {counts['ok'] / elapsed:.2f} q/s",
+                    end="",
+                    file=sys.stderr,
+                )
+            finally:
+                semaphore.release()
+
+        # Questions are read lazily: a new one starts only when a slot is free
+        for item in read_questions(input_path):
+            if str(item["id"]) in done:
+                counts["skipped"] += 1
+                continue
+            await semaphore.acquire()
+            task = asyncio.create_task(process(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    print(file=sys.stderr)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("input", help="JSONL file with questions")
+    parser.add_argument("output", help="JSONL file for results, appended to")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-rps", type=float, help="GigaChat requests per second")
+    parser.add_argument("--search-rps", type=float, help="Tavily requests per second")
+    parser.add_argument(
+        "--run-id",
+        help="namespace of the checkpoint threads, derived from the output path by default",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    # Rate limiters are built when the graph is imported
+    if args.llm_rps:
+        os.environ["GIGACHAT_RPS"] = str(args.llm_rps)
+    if args.search_rps:
+        os.environ["TAVILY_RPS"] = str(args.search_rps)
+
+    asyncio.run(run_batch(args.input, args.output, args.concurrency, args.run_id))
+
+
+if __name__ == "__main__":
+    main()
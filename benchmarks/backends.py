@@ -0,0 +1,321 @@
+"""Checks the client layer against local stubs of the Tavily and GigaChat APIs.
+
+Tavily: a flaky backend (retries), a burst of searches (in-flight cap and
+keep-alive connections) and a backend that is down (circuit breaker).
+GigaChat: a stream failing before its first chunk (retried) and after it (not
+retried), a second event loop (a client of its own that takes over the access
+token) and a backend that is down (circuit breaker).
+
+python -m benchmarks.backends
+"""
+
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubTavily(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Scenario state, set by the scenarios below
+    fail_next = 0
+    delay = 0.0
+    requests = 0
+    in_flight = 0
+    max_in_flight = 0
+    peers = set()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        with cls.lock:
+            cls.requests += 1
+            cls.peers.add(self.client_address)
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            failing = cls.fail_next > 0
+            cls.fail_next -= failing
+        time.sleep(cls.delay)
+        with cls.lock:
+            cls.in_flight -= 1
+        if failing:
+            status, data = 503, b'{"detail": "unavailable"}'
+        else:
+            status = 200
+            data = json.dumps(
+                {"query": body["query"], "results": [{"url": "https://example.com"}]}
+            ).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+    @classmethod
+    def reset(cls, fail_next=0, delay=0.0):
+        cls.fail_next, cls.delay = fail_next, delay
+        cls.requests = cls.in_flight = cls.max_in_flight = 0
+        cls.peers = set()
+
+
+class StubGigaChat(BaseHTTPRequestHandler):
+    """OAuth endpoint and streaming chat completions."""
+
+    protocol_version = "HTTP/1.1"
+    token = "stub-token"
+    # Scenario state, set by the scenarios below
+    fail_next = 0
+    cut_next = 0
+    auth_requests = 0
+    chat_requests = 0
+    tokens = set()
+    peers = set()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.endswith("/oauth"):
+            with type(self).lock:
+                type(self).auth_requests += 1
+            return self.send(200, "application/json", self.auth_body())
+        cls = type(self)
+        with cls.lock:
+            cls.chat_requests += 1
+            cls.tokens.add(self.headers.get("Authorization"))
+            cls.peers.add(self.client_address)
+            failing, cutting = cls.fail_next > 0, cls.cut_next > 0
+            cls.fail_next -= failing
+            cls.cut_next -= cutting
+        if failing:
+            return self.send(503, "application/json", b'{"message": "unavailable"}')
+        first, rest = self.event("Hello"), self.event(" world") + b"data: [DONE]\n\n"
+        if not cutting:
+            return self.send(200, "text/event-stream", first + rest)
+        # The connection drops in the middle of the announced body
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(first + rest)))
+        self.end_headers()
+        self.wfile.write(first)
+        self.wfile.flush()
+        self.close_connection = True
+
+    def auth_body(self) -> bytes:
+        expires_at = int((time.time() + 1800) * 1000)
+        return json.dumps(
+            {"access_token": self.token, "expires_at": expires_at}
+        ).encode()
+
+    def event(self, content: str) -> bytes:
+        chunk = {
+            "choices": [
+                {"delta": {"role": "assistant", "content": content}, "index": 0}
+            ],
+            "created": int(time.time()),
+            "model": "GigaChat",
+            "object": "chat.completion",
+        }
+        return f"data: {json.dumps(chunk)}\n\n".encode()
+
+    def send(self, status: int, content_type: str, data: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+    @classmethod
+    def reset(cls, fail_next=0, cut_next=0):
+        cls.fail_next, cls.cut_next = fail_next, cut_next
+        cls.chat_requests = 0
+        cls.tokens, cls.peers = set(), set()
+
+
+def serve(handler) -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+gigachat_url = serve(StubGigaChat)
+for name in ("GIGACHAT_USER", "GIGACHAT_PASSWORD", "GIGACHAT_ACCESS_TOKEN"):
+    os.environ.pop(name, None)
+os.environ.update(
+    TAVILY_BASE_URL=serve(StubTavily),
+    TAVILY_API_KEY="stub",
+    SEARCH_CACHE_BACKEND="none",
+    TAVILY_MAX_IN_FLIGHT="4",
+    TAVILY_RETRIES="2",
+    TAVILY_BACKOFF="0.05",
+    TAVILY_BREAKER_THRESHOLD="3",
+    TAVILY_BREAKER_COOLDOWN="0.5",
+    GIGACHAT_BASE_URL=gigachat_url,
+    GIGACHAT_AUTH_URL=f"{gigachat_url}/oauth",
+    GIGACHAT_CREDENTIALS=base64.b64encode(b"stub:stub").decode(),
+    GIGACHAT_RPS="",
+    GIGACHAT_RETRIES="2",
+    GIGACHAT_BACKOFF="0.05",
+    GIGACHAT_BREAKER_THRESHOLD="3",
+    GIGACHAT_BREAKER_COOLDOWN="0.5",
+)
+
+from backends import BackendUnavailable
+from models import GIGACHAT_BACKEND, get_client
+from search import TAVILY_BACKEND, search_many
+
+
+def report(name, ok, details):
+    print(f"{'ok' if ok else 'FAIL':>4}  {name}: {details}")
+    return ok
+
+
+async def flaky():
+    StubTavily.reset(fail_next=2)
+    responses, errors, _ = await search_many(["flaky"], "basic")
+    return report(
+        "tavily retry",
+        "flaky" in responses and StubTavily.requests == 3,
+        f"{StubTavily.requests} requests, errors {errors}",
+    )
+
+
+async def burst(searches=32):
+    StubTavily.reset(delay=0.05)
+    queries = [f"query {i}" for i in range(searches)]
+    results = await asyncio.gather(
+        *(search_many([query], "basic") for query in queries)
+    )
+    found = sum(len(responses) for responses, _, _ in results)
+    return report(
+        "tavily pool",
+        found == searches
+        and StubTavily.max_in_flight <= TAVILY_BACKEND.max_in_flight
+        and len(StubTavily.peers) <= TAVILY_BACKEND.max_in_flight,
+        f"{found}/{searches} found, max in flight {StubTavily.max_in_flight}, "
+        f"{len(StubTavily.peers)} connections",
+    )
+
+
+async def outage():
+    StubTavily.reset(fail_next=1000)
+    for i in range(3):
+        await search_many([f"down {i}"], "basic")
+    sent = StubTavily.requests
+    start = time.perf_counter()
+    _, errors, _ = await search_many(["skipped"], "basic")
+    skipped = time.perf_counter() - start
+    ok = report(
+        "tavily breaker open",
+        TAVILY_BACKEND.stats()["open"]
+        and StubTavily.requests == sent
+        and errors == {"skipped": "BackendUnavailable"},
+        f"{sent} requests before opening, rejected in {skipped * 1000:.1f} ms",
+    )
+
+    StubTavily.reset()
+    await asyncio.sleep(TAVILY_BACKEND.cooldown)
+    responses, _, _ = await search_many(["recovered"], "basic")
+    return ok & report(
+        "tavily breaker closed",
+        "recovered" in responses and not TAVILY_BACKEND.stats()["open"],
+        str(TAVILY_BACKEND.stats()),
+    )
+
+
+async def complete(llm) -> tuple:
+    """Streams a reply: (chunks received, error raised or None)."""
+    chunks = []
+    try:
+        async for chunk in llm.astream("Hi"):
+            chunks.append(chunk.content)
+    except Exception as error:
+        return chunks, error
+    return chunks, None
+
+
+async def gigachat_flaky(llm):
+    StubGigaChat.reset(fail_next=2)
+    chunks, error = await complete(llm)
+    return report(
+        "gigachat retry before first chunk",
+        "".join(chunks) == "Hello world" and StubGigaChat.chat_requests == 3,
+        f"{StubGigaChat.chat_requests} requests, error {error!r}",
+    )
+
+
+async def gigachat_cut(llm):
+    StubGigaChat.reset(cut_next=1)
+    chunks, error = await complete(llm)
+    return report(
+        "gigachat no retry after first chunk",
+        chunks == ["Hello"] and error is not None and StubGigaChat.chat_requests == 1,
+        f"{StubGigaChat.chat_requests} requests, got {chunks}, error {error!r}",
+    )
+
+
+async def gigachat_loops(llm):
+    StubGigaChat.reset()
+    auth_before = StubGigaChat.auth_requests
+    # Streamlit runs every question in a new event loop
+    results = [await complete(llm)]
+    results.append(await asyncio.to_thread(asyncio.run, complete(llm)))
+    return report(
+        "gigachat client per loop",
+        all("".join(chunks) == "Hello world" for chunks, _ in results)
+        and StubGigaChat.auth_requests == auth_before
+        and StubGigaChat.tokens == {f"Bearer {StubGigaChat.token}"}
+        and len(StubGigaChat.peers) == 2,
+        f"errors {[error for _, error in results]}, "
+        f"{StubGigaChat.auth_requests - auth_before} new token requests, "
+        f"{len(StubGigaChat.peers)} connections",
+    )
+
+
+async def gigachat_outage(llm):
+    StubGigaChat.reset(fail_next=1000)
+    await complete(llm)
+    sent = StubGigaChat.chat_requests
+    _, error = await complete(llm)
+    ok = report(
+        "gigachat breaker open",
+        GIGACHAT_BACKEND.stats()["open"]
+        and StubGigaChat.chat_requests == sent
+        and isinstance(error, BackendUnavailable),
+        f"{sent} requests before opening, then {error!r}",
+    )
+
+    StubGigaChat.reset()
+    await asyncio.sleep(GIGACHAT_BACKEND.cooldown)
+    chunks, _ = await complete(llm)
+    return ok & report(
+        "gigachat breaker closed",
+        "".join(chunks) == "Hello world" and not GIGACHAT_BACKEND.stats()["open"],
+        str(GIGACHAT_BACKEND.stats()),
+    )
+
+
+async def main():
+    llm = get_client("answer")
+    results = [await flaky(), await burst(), await outage()]
+    results += [
+        await gigachat_flaky(llm),
+        await gigachat_cut(llm),
+        await gigachat_loops(llm),
+        await gigachat_outage(llm),
+    ]
+    if not all(results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
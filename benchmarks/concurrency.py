@@ -0,0 +1,56 @@
+"""Throughput of the reasoning graph for N concurrent sessions against a stub LLM.
+
+python -m benchmarks.concurrency --sessions 1 8 32 --token-delay 0.01
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+# Sessions here are independent one-off runs
+os.environ.setdefault("CHECKPOINTER_BACKEND", "none")
+
+from langchain_core.messages import HumanMessage
+
+import graph
+from benchmarks.stub_llm import StubChatModel
+from models import set_llm_override
+
+
+async def run_session(question):
+    tokens = 0
+    async for event in graph.graph_runnable.astream_events(
+        {"messages": [HumanMessage(content=question)]}, version="v2"
+    ):
+        if event["event"] == "on_chat_model_stream":
+            tokens += 1
+    return tokens
+
+
+async def run(sessions):
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(run_session(f"Вопрос номер {i}") for i in range(sessions))
+    )
+    return time.perf_counter() - start, sum(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    args = parser.parse_args()
+
+    set_llm_override(StubChatModel(token_delay=args.token_delay))
+
+    print(f"{'sessions':>8} {'wall, s':>9} {'sessions/s':>11} {'tokens/s':>10}")
+    for sessions in args.sessions:
+        elapsed, tokens = asyncio.run(run(sessions))
+        print(
+            f"{sessions:>8} {elapsed:>9.2f} {sessions / elapsed:>11.2f} {tokens / elapsed:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Latency and accuracy of self-consistency drafts on the replay question set.
+
+Replays every fixture with K drafts per answer (K=1 is the plain graph). The
+replay models the sampling of the drafts: a greedy call (the clients' top_p=0)
+gets the fixture's answer of the current round, as recorded, while a call with
+sampling bound (top_p > 0) draws one of the fixture's answers at random. The
+critic judges the draft it is given: it serves the fixture's `good` verdict when
+the draft's final value matches the fixture's `expected` one, and the first other
+verdict otherwise. Accuracy is therefore only as realistic as the spread of the
+recorded answers; fixtures without `expected` show the overhead of the mode on
+the questions it must leave alone.
+
+    python -m benchmarks.self_consistency --k 1 3 5 --repeat 20 --speed 0
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import re
+import statistics
+from contextlib import contextmanager
+
+from pydantic import Field
+
+os.environ.setdefault("SEARCH_CACHE_BACKEND", "none")
+os.environ.setdefault("LLM_CACHE_BACKEND", "none")
+os.environ.setdefault("ANSWER_CACHE_BACKEND", "none")
+os.environ.setdefault("CHECKPOINTER_BACKEND", "none")
+
+import models
+import search
+import self_consistency
+from batch import run_question
+from replay import ReplayChatModel, load_fixture, prompt_role, replay_search
+from self_consistency import final_value
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+_LAST_ANSWER_RE = re.compile(r"<LAST_ANSWER>(.*?)</LAST_ANSWER>", re.DOTALL)
+
+
+class SamplingReplayChatModel(ReplayChatModel):
+    """Replay with sampled answer drafts and a critic that approves exactly the
+    drafts with the expected value."""
+
+    seed: int = 0
+    reviews: list = Field(default_factory=list)
+    rng: random.Random = Field(default_factory=random.Random)
+
+    def model_post_init(self, context):
+        self.rng.seed(self.seed)
+
+    def _next_call(self, messages, **kwargs) -> dict:
+        role = prompt_role(messages)
+        if role == "answer" and kwargs.get("top_p"):
+            # A sampled draft does not take the round's recorded answer
+            return self.rng.choice(self.fixture["llm"]["answer"])
+        expected = self.fixture.get("expected")
+        if role != "critique" or expected is None:
+            return super()._next_call(messages, **kwargs)
+        draft = _LAST_ANSWER_RE.search(messages[0].content).group(1)
+        correct = final_value(draft) == expected
+        self.reviews.append(correct)
+        calls = self.fixture["llm"]["critique"]
+        verdicts = [json.loads(call["text"])["final_decision"] for call in calls]
+        matching = [
+            call
+            for call, verdict in zip(calls, verdicts)
+            if (verdict == "good") == correct
+        ]
+        return (matching or calls)[0]
+
+
+@contextmanager
+def sampling(fixture: dict, speed: float, seed: int):
+    """Like replay.replaying, yields the replay model to read its reviews."""
+    llm = SamplingReplayChatModel(fixture=fixture, speed=speed, seed=seed)
+    models.set_llm_override(llm)
+    search.set_search_override(replay_search(fixture, speed))
+    try:
+        yield llm
+    finally:
+        models.set_llm_override(None)
+        search.set_search_override(None)
+
+
+async def benchmark(fixtures: dict, drafts: int, repeat: int, speed: float) -> dict:
+    self_consistency.SELF_CONSISTENCY = "weak"
+    self_consistency.SELF_CONSISTENCY_K = drafts
+    report = {}
+    for name, fixture in fixtures.items():
+        runs = []
+        for seed in range(repeat):
+            with sampling(fixture, speed, seed) as llm:
+                run = await run_question(fixture["question"])
+            runs.append((run, llm.reviews))
+        # Whether the first and the last draft the critic saw were right, over the runs
+        judged = [reviews for _, reviews in runs if reviews]
+        report[name] = {
+            "expected": fixture.get("expected"),
+            "llm_calls": statistics.mean(run["llm_calls"] for run, _ in runs),
+            "prompt_tokens": statistics.mean(run["prompt_tokens"] for run, _ in runs),
+            "critique_iterations": statistics.mean(
+                run["critique_iterations"] for run, _ in runs
+            ),
+            "first_correct": (
+                statistics.mean(reviews[0] for reviews in judged) if judged else None
+            ),
+            "last_correct": (
+                statistics.mean(reviews[-1] for reviews in judged) if judged else None
+            ),
+            "latency": statistics.mean(run["latency"] for run, _ in runs),
+        }
+    return report
+
+
+def accuracy(report: dict, key: str) -> str:
+    judged = [row[key] for row in report.values() if row[key] is not None]
+    return f"{statistics.mean(judged):.0%}" if judged else "-"
+
+
+def print_report(reports: dict):
+    print(
+        f"{'K':>2} {'fixture':<10} {'LLM calls':>9} {'prompt tok':>10} "
+        f"{'critiques':>9} {'1st draft ok':>12} {'mean, s':>8}"
+    )
+    for drafts, report in reports.items():
+        for name, row in report.items():
+            first = (
+                "-" if row["first_correct"] is None else f"{row['first_correct']:.0%}"
+            )
+            print(
+                f"{drafts:>2} {name:<10} {row['llm_calls']:>9.1f} "
+                f"{row['prompt_tokens']:>10.0f} {row['critique_iterations']:>9.2f} "
+                f"{first:>12} {row['latency']:>8.2f}"
+            )
+    print("\nK  first-review accuracy  final accuracy  total mean, s  LLM calls")
+    for drafts, report in reports.items():
+        print(
+            f"{drafts:<2} {accuracy(report, 'first_correct'):>21} "
+            f"{accuracy(report, 'last_correct'):>15} "
+            f"{sum(row['latency'] for row in report.values()):>14.2f} "
+            f"{sum(row['llm_calls'] for row in report.values()):>10.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3])
+    parser.add_argument(
+        "--repeat", type=int, default=10, help="runs per fixture, one seed each"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="timing scale, 0 replays without delays",
+    )
+    args = parser.parse_args()
+
+    fixtures = {
+        os.path.splitext(os.path.basename(path))[0]: load_fixture(path)
+        for path in sorted(glob.glob(os.path.join(args.fixtures, "*.json")))
+    }
+    reports = {
+        drafts: asyncio.run(benchmark(fixtures, drafts, args.repeat, args.speed))
+        for drafts in args.k
+    }
+    print_report(reports)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Cold start of the entry points: import time and first-request latency.
+
+Each measurement runs in a fresh interpreter. `langgraph dev` loads graph.py,
+Streamlit loads the event handler; the requests go to a stub LLM with no token
+delay, so the latency is the overhead of the graph itself.
+
+python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINTS = {
+    "langgraph dev": "import graph; runnable = graph.graph_api_runnable",
+    "streamlit": "import astream_events_handler; runnable = astream_events_handler.graph_runnable",
+}
+
+PROBE = """
+import time
+start = time.perf_counter()
+{entry}
+imported = time.perf_counter() - start
+
+import asyncio
+from langchain_core.messages import HumanMessage
+from benchmarks.stub_llm import StubChatModel
+from models import get_client, set_llm_override
+
+async def request():
+    start = time.perf_counter()
+    await runnable.ainvoke({{"messages": [HumanMessage(content="Сколько будет 2+2?")]}})
+    return time.perf_counter() - start
+
+set_llm_override(StubChatModel(token_delay=0))
+first = asyncio.run(request())
+second = asyncio.run(request())
+
+start = time.perf_counter()
+get_client("answer")
+client = time.perf_counter() - start
+print(json.dumps({{"import": imported, "first": first, "second": second, "client": client}}))
+"""
+
+
+def probe(entry: str) -> dict:
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.getcwd(),
+        CHECKPOINTER_BACKEND="none",
+        SEARCH_CACHE_BACKEND="none",
+        LLM_CACHE_BACKEND="none",
+        ANSWER_CACHE_BACKEND="none",
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", "import json\n" + PROBE.format(entry=entry)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'entry point':<14} {'import, s':>10} {'1st request, s':>15} "
+        f"{'2nd request, s':>15} {'GigaChat client, s':>19}"
+    )
+    for name, entry in ENTRY_POINTS.items():
+        runs = [probe(entry) for _ in range(args.runs)]
+        median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        print(
+            f"{name:<14} {median['import']:>10.3f} {median['first']:>15.3f} "
+            f"{median['second']:>15.3f} {median['client']:>19.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
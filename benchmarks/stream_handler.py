@@ -0,0 +1,122 @@
+"""CPU time of the Streamlit stream handler per 10k tokens.
+
+Replays an event stream through the handler with Streamlit placeholders replaced
+by objects that only serialize what they are given, as Streamlit does before
+sending it to the browser. Compares with the previous handler, which re-rendered
+the whole transcript on every token.
+
+    python -m benchmarks.stream_handler --tokens 20000
+    python -m benchmarks.stream_handler --events recorded_events.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from astream_events_handler import render_events
+
+NODES = [
+    "🤔 thinking",
+    "1️⃣ first step think",
+    "👨 answering",
+    "👨‍⚖️ self-criticque",
+    "🏁 finalizing",
+]
+
+
+class FakePlaceholder:
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def container(self):
+        return self
+
+    def empty(self):
+        return self
+
+    def write(self, text):
+        self.bytes_sent += len(str(text).encode())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def synthetic_events(tokens, token_text="токен "):
+    per_node = tokens // len(NODES)
+    for node in NODES:
+        for _ in range(per_node):
+            yield {
+                "event": "on_chat_model_stream",
+                "metadata": {"langgraph_node": node},
+                "data": {"chunk": SimpleNamespace(content=token_text)},
+            }
+
+
+def load_events(path):
+    """Events saved as JSONL with the chunk content stored as a plain string."""
+    with open(path) as f:
+        for line in f:
+            event = json.loads(line)
+            chunk = event.get("data", {}).get("chunk")
+            if isinstance(chunk, str):
+                event["data"]["chunk"] = SimpleNamespace(content=chunk)
+            yield event
+
+
+async def aiter(events):
+    for event in events:
+        yield event
+
+
+async def legacy_render(events, placeholder):
+    """The previous handler: string concatenation and a full re-render per token."""
+    final_text = ""
+    last_node = None
+    async for event in events:
+        node = event["metadata"].get("langgraph_node", None)
+        if last_node != node:
+            if last_node is not None:
+                final_text += f"\n<\\{last_node}>\n\n"
+            if node is not None:
+                final_text += f"\n\n<{node}>\n\n"
+        last_node = node
+        if event["event"] == "on_chat_model_stream":
+            addition = event["data"]["chunk"].content
+            final_text += addition
+            if addition:
+                placeholder.write(final_text)
+    return final_text
+
+
+def measure(render, events):
+    placeholder = FakePlaceholder()
+    start = time.process_time()
+    asyncio.run(render(aiter(events), placeholder))
+    return time.process_time() - start, placeholder.bytes_sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--events", help="JSONL file with recorded astream_events")
+    args = parser.parse_args()
+
+    if args.events:
+        events = list(load_events(args.events))
+    else:
+        events = list(synthetic_events(args.tokens))
+    tokens = sum(event["event"] == "on_chat_model_stream" for event in events)
+
+    print(f"{'handler':>8} {'CPU s/10k tokens':>17} {'MB sent':>9}")
+    for name, render in [("legacy", legacy_render), ("buffered", render_events)]:
+        cpu, sent = measure(render, events)
+        print(f"{name:>8} {cpu * 10000 / tokens:>17.4f} {sent / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
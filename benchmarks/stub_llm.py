@@ -0,0 +1,88 @@
+import asyncio
+import json
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FIRST_STEP_RESPONSE = json.dumps(
+    {"search_queries": [], "final_decision": "writer"}, ensure_ascii=False
+)
+CRITIQUE_RESPONSE = json.dumps(
+    {
+        "thoughts": "Ответ корректный.",
+        "critique": "Замечаний нет.",
+        "is_new_critique": False,
+        "search_queries": [],
+        "search_mode": "basic",
+        "final_decision": "good",
+    },
+    ensure_ascii=False,
+)
+TEXT_RESPONSE = "Это ответ заглушки, который имитирует генерацию модели. " * 8
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model stub with a fixed per-token delay.
+
+    Picks the answer by the role written in the system prompt, so every node of
+    the graph gets a response it can parse.
+    """
+
+    token_delay: float = 0.01
+    chunk_size: int = 16
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _pick_response(self, messages: List[BaseMessage]) -> str:
+        prompt = messages[0].content
+        if "агент-координатор" in prompt:
+            return FIRST_STEP_RESPONSE
+        if "агент-критик" in prompt:
+            return CRITIQUE_RESPONSE
+        return TEXT_RESPONSE
+
+    def _chunks(self, text: str):
+        for i in range(0, len(text), self.chunk_size):
+            yield text[i : i + self.chunk_size]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = self._pick_response(messages)
+        time.sleep(self.token_delay * len(list(self._chunks(text))))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ):
+        for piece in self._chunks(self._pick_response(messages)):
+            await asyncio.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = ""
+        async for chunk in self._astream(messages, stop, run_manager, **kwargs):
+            text += chunk.message.content
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
@@ -0,0 +1,131 @@
+"""Offline benchmark of the reasoning graph over recorded fixtures.
+
+Replays every fixture in benchmarks/fixtures (one question per route: finalize,
+search, writer, fix loop) with fake GigaChat and Tavily clients, so no network is
+needed, and reports per-node latency, LLM calls, prompt tokens, critique
+iterations and end-to-end p50/p95.
+
+    python -m benchmarks.suite --repeat 5
+    python -m benchmarks.suite --speed 0 --json report.json
+    python -m benchmarks.suite --record questions.jsonl  # live keys required
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import statistics
+from collections import defaultdict
+
+# Caches would turn repeated runs into cache hits
+os.environ.setdefault("SEARCH_CACHE_BACKEND", "none")
+os.environ.setdefault("LLM_CACHE_BACKEND", "none")
+os.environ.setdefault("ANSWER_CACHE_BACKEND", "none")
+os.environ.setdefault("CHECKPOINTER_BACKEND", "none")
+
+from batch import run_question
+from replay import load_fixture, recording, replaying, save_fixture
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+async def benchmark(fixtures, repeat: int, speed: float) -> dict:
+    report = {}
+    for name, fixture in fixtures.items():
+        runs = []
+        for _ in range(repeat):
+            with replaying(fixture, speed):
+                runs.append(await run_question(fixture["question"]))
+        node_latency = defaultdict(list)
+        for run in runs:
+            for node, latency in run["node_latency"].items():
+                node_latency[node].append(latency)
+        latencies = [run["latency"] for run in runs]
+        report[name] = {
+            "route": fixture.get("route"),
+            "path": runs[-1]["path"],
+            "llm_calls": runs[-1]["llm_calls"],
+            "prompt_tokens": runs[-1]["prompt_tokens"],
+            "critique_iterations": runs[-1]["critique_iterations"],
+            "p50": statistics.median(latencies),
+            "p95": percentile(latencies, 95),
+            "node_latency": {
+                node: statistics.median(values) for node, values in node_latency.items()
+            },
+        }
+    return report
+
+
+def print_report(report: dict):
+    print(
+        f"{'fixture':<10} {'route':<9} {'LLM calls':>9} {'prompt tok':>10} "
+        f"{'critiques':>9} {'p50, s':>7} {'p95, s':>7}"
+    )
+    for name, row in report.items():
+        print(
+            f"{name:<10} {row['route'] or '':<9} {row['llm_calls']:>9} "
+            f"{row['prompt_tokens']:>10} {row['critique_iterations']:>9} "
+            f"{row['p50']:>7.2f} {row['p95']:>7.2f}"
+        )
+    print("\nmedian node latency, s")
+    for name, row in report.items():
+        nodes = ", ".join(
+            f"{node} {latency:.2f}" for node, latency in row["node_latency"].items()
+        )
+        print(f"{name:<10} {nodes}")
+
+
+async def record(questions_path: str, fixtures_dir: str):
+    """Runs the questions ({"id", "question", "route"} per line) live and saves fixtures."""
+    with open(questions_path) as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    for item in questions:
+        with recording(item["question"]) as fixture:
+            await run_question(item["question"])
+        fixture["route"] = item.get("route")
+        save_fixture(fixture, os.path.join(fixtures_dir, f"{item['id']}.json"))
+        print(f"recorded {item['id']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="timing scale, 0 replays without delays",
+    )
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument(
+        "--record", help="record fixtures for the questions in this JSONL file"
+    )
+    args = parser.parse_args()
+
+    if args.record:
+        asyncio.run(record(args.record, args.fixtures))
+        return
+
+    fixtures = {
+        os.path.splitext(os.path.basename(path))[0]: load_fixture(path)
+        for path in sorted(glob.glob(os.path.join(args.fixtures, "*.json")))
+    }
+    report = asyncio.run(benchmark(fixtures, args.repeat, args.speed))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class BaseCache:
+    """Key-value cache with TTL, bounded size and hit/miss counters.
+
+    Values must be JSON-serializable so that every backend can store them.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_size: int = 1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def get_first(self, keys) -> Optional[Any]:
+        """Value of the first key present; counts as a single hit or miss."""
+        with self._lock:
+            for key in keys:
+                value = self._get(key)
+                if value is not None:
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._set(key, value)
+
+    def keys(self) -> list:
+        """Keys of the live entries, least recently used first."""
+        with self._lock:
+            return self._keys()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self),
+        }
+
+    def _get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def _keys(self) -> list:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryCache(BaseCache):
+    """In-process LRU cache."""
+
+    def __init__(self, ttl: Optional[float] = None, max_size: int = 1000):
+        super().__init__(ttl, max_size)
+        self._data = OrderedDict()
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        created, value = item
+        if self._expired(created):
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def _set(self, key, value):
+        self._data[key] = (time.time(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def _keys(self):
+        return [
+            key
+            for key, (created, _) in self._data.items()
+            if not self._expired(created)
+        ]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteCache(BaseCache):
+    """On-disk LRU cache in a single SQLite table, shared between processes."""
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_size: int = 1000):
+        super().__init__(ttl, max_size)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)"
+        )
+        self._conn.commit()
+
+    def _get(self, key):
+        row = self._conn.execute(
+            "SELECT value, created FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if self._expired(created):
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+            return None
+        self._conn.execute(
+            "UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key)
+        )
+        self._conn.commit()
+        return json.loads(value)
+
+    def _set(self, key, value):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, created, accessed) "
+            "VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), now, now),
+        )
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        )
+        self._conn.commit()
+
+    def _keys(self):
+        rows = self._conn.execute(
+            "SELECT key, created FROM cache ORDER BY accessed"
+        ).fetchall()
+        return [key for key, created in rows if not self._expired(created)]
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+def make_cache(
+    prefix: str,
+    default_path: str,
+    default_ttl: Optional[float] = None,
+    default_backend: str = "memory",
+) -> Optional[BaseCache]:
+    """Build a cache from `<prefix>_BACKEND`, `_TTL`, `_MAX_SIZE` and `_PATH` env vars.
+
+    Backend is one of `memory`, `sqlite` or `none`. Returns None when disabled.
+    """
+    backend = os.getenv(f"{prefix}_BACKEND", default_backend).lower()
+    ttl = os.getenv(f"{prefix}_TTL")
+    ttl = float(ttl) if ttl else default_ttl
+    max_size = int(os.getenv(f"{prefix}_MAX_SIZE", "1000"))
+
+    if backend == "memory":
+        return MemoryCache(ttl=ttl, max_size=max_size)
+    if backend == "sqlite":
+        path = os.getenv(f"{prefix}_PATH", default_path)
+        return SqliteCache(path, ttl=ttl, max_size=max_size)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown {prefix}_BACKEND: {backend}")
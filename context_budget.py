@@ -0,0 +1,320 @@
+import html
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# GigaChat averages about three characters per token on mixed Russian/English text
+CHARS_PER_TOKEN = 3
+
+CONTEXT_BUDGETS = {
+    "answer": int(os.getenv("CONTEXT_BUDGET_ANSWER", "6000")),
+    "critique": int(os.getenv("CONTEXT_BUDGET_CRITIQUE", "3000")),
+    "finalize": int(os.getenv("CONTEXT_BUDGET_FINALIZE", "6000")),
+}
+
+# A snippet is not worth including if less than this many tokens are left for it
+MIN_SNIPPET_TOKENS = 50
+
+# Raw pages of deep search are split into chunks of about CHUNK_TOKENS tokens,
+# and at most DEEP_TOP_K of them go into a prompt
+CHUNK_TOKENS = int(os.getenv("DEEP_CHUNK_TOKENS", "150"))
+DEEP_TOP_K = int(os.getenv("DEEP_TOP_K", "8"))
+
+_SCRIPT_RE = re.compile(r"<(script|style|noscript)[^>]*>.*?</\1>", re.S | re.I)
+_TAG_RE = re.compile(r"<[^>]+>")
+_WORD_RE = re.compile(r"\w+")
+_BOILERPLATE_RE = re.compile(
+    r"cookie|javascript|subscribe|sign in|log in|all rights reserved|privacy policy"
+    r"|подпис|войти|регистрац|все права защищены|политика конфиденциальности",
+    re.I,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_prompt_tokens(prompt, inputs: dict) -> int:
+    return estimate_tokens(prompt.invoke(inputs).to_string())
+
+
+def iter_clean_lines(text: str) -> Iterator[str]:
+    """Lines of page text without HTML, navigation boilerplate and repeats."""
+    text = _SCRIPT_RE.sub(" ", text)
+    text = html.unescape(_TAG_RE.sub(" ", text))
+    seen = set()
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not line or line in seen:
+            continue
+        # Short lines with boilerplate words are menus, banners and footers
+        if len(line) < 120 and _BOILERPLATE_RE.search(line):
+            continue
+        seen.add(line)
+        yield line
+
+
+def clean_text(text: str) -> str:
+    return "\n".join(iter_clean_lines(text))
+
+
+def tokenize(text: str) -> List[str]:
+    # Cutting words to a fixed prefix is a cheap stemmer for Russian inflections
+    return [word[:6] for word in _WORD_RE.findall(text.lower())]
+
+
+class BM25:
+    def __init__(self, docs: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = [Counter(doc) for doc in docs]
+        self.lengths = [len(doc) for doc in docs]
+        self.avg_length = sum(self.lengths) / len(docs) if docs else 0.0
+        self.df = Counter(term for doc in self.docs for term in doc)
+
+    def idf(self, term: str) -> float:
+        n = len(self.docs)
+        df = self.df.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def score(self, query: List[str], index: int) -> float:
+        doc = self.docs[index]
+        length_norm = 1 - self.b + self.b * self.lengths[index] / (self.avg_length or 1)
+        result = 0.0
+        for term in set(query):
+            tf = doc.get(term, 0)
+            if tf:
+                result += (
+                    self.idf(term) * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+                )
+        return result
+
+    def rank(self, query: List[str]) -> List[int]:
+        return sorted(
+            range(len(self.docs)), key=lambda i: self.score(query, i), reverse=True
+        )
+
+
+def split_chunks(
+    lines: Iterator[str], chunk_tokens: int = CHUNK_TOKENS
+) -> Iterator[str]:
+    """Groups lines into chunks of about `chunk_tokens`, splitting long lines at spaces."""
+    limit = chunk_tokens * CHARS_PER_TOKEN
+    chunk = []
+    size = 0
+    for line in lines:
+        while len(line) > limit:
+            cut = line.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            if chunk:
+                yield "\n".join(chunk)
+                chunk, size = [], 0
+            yield line[:cut]
+            line = line[cut:].lstrip()
+        if size + len(line) > limit and chunk:
+            yield "\n".join(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        yield "\n".join(chunk)
+
+
+class PageChunks:
+    """Cleaned, chunked and tokenized pages by URL, shared by all runs.
+
+    A page fetched again by another query or a later critique iteration is not
+    processed twice. Holds at most `max_pages` pages and `max_chunks` chunks in
+    total, evicting the least recently used pages; only a page longer than the
+    whole limit is cut, and the number of chunks cut off is reported.
+    """
+
+    def __init__(self, max_pages: int = 100, max_chunks: int = 20000):
+        self.max_pages = max_pages
+        self.max_chunks = max_chunks
+        self._pages = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str, raw: str) -> Tuple[List[Tuple[str, List[str]]], int]:
+        """Chunks of the page and how many chunks past the limit were not indexed."""
+        key = (url, hash(raw))
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+        chunks = []
+        cut = 0
+        for chunk in split_chunks(iter_clean_lines(raw)):
+            if len(chunks) < self.max_chunks:
+                chunks.append((chunk, tokenize(chunk)))
+            else:
+                cut += 1
+        if cut:
+            logger.warning("Indexed %d chunks of %s, %d cut off", len(chunks), url, cut)
+        with self._lock:
+            if key not in self._pages:
+                self._pages[key] = (chunks, cut)
+                self._total += len(chunks)
+            while len(self._pages) > 1 and (
+                len(self._pages) > self.max_pages or self._total > self.max_chunks
+            ):
+                _, (evicted, _) = self._pages.popitem(last=False)
+                self._total -= len(evicted)
+        return chunks, cut
+
+
+PAGE_CHUNKS = PageChunks(
+    max_pages=int(os.getenv("DEEP_INDEX_MAX_PAGES", "100")),
+    max_chunks=int(os.getenv("DEEP_INDEX_MAX_CHUNKS", "20000")),
+)
+
+# Chunk indexes by the set of pages they cover: between critique iterations the
+# search results rarely change, so the index is reused as is
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+MAX_INDEXES = 16
+
+
+def index_pages(search_results: Dict):
+    """Chunks the raw pages of deep search results ahead of the prompts that need them."""
+    for response in (search_results or {}).values():
+        if isinstance(response, dict):
+            for result in response.get("results", []):
+                if result.get("raw_content"):
+                    PAGE_CHUNKS.get(result.get("url", ""), result["raw_content"])
+
+
+def _collect_items(search_results: Dict) -> Tuple[List[dict], int]:
+    """Flattens Tavily responses of all queries, merging results with the same URL."""
+    items = {}
+    duplicates = 0
+    for response in (search_results or {}).values():
+        if not isinstance(response, dict):
+            continue
+        for result in response.get("results", []):
+            url = result.get("url") or result.get("title") or str(len(items))
+            item = {
+                "title": result.get("title", ""),
+                "url": url,
+                "text": clean_text(result.get("content") or ""),
+                "raw": result.get("raw_content") or "",
+            }
+            if url in items:
+                duplicates += 1
+                old = items[url]
+                if (len(item["raw"]), len(item["text"])) <= (
+                    len(old["raw"]),
+                    len(old["text"]),
+                ):
+                    continue
+            items[url] = item
+    return list(items.values()), duplicates
+
+
+def _chunk_index(items: List[dict]):
+    """Chunks of all items, a BM25 index over them and the number of page chunks
+    left out of the index.
+
+    A result without a raw page is a single chunk of its snippet; a raw page
+    adds its chunks after the snippet.
+    """
+    key = tuple((item["url"], hash(item["text"]), hash(item["raw"])) for item in items)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    chunks = []
+    unindexed = 0
+    for number, item in enumerate(items):
+        if item["text"]:
+            chunks.append(
+                (
+                    number,
+                    item["text"],
+                    tokenize(item["title"] + " " + item["text"]),
+                    False,
+                )
+            )
+        if item["raw"]:
+            page, cut = PAGE_CHUNKS.get(item["url"], item["raw"])
+            unindexed += cut
+            for text, tokens in page:
+                chunks.append((number, text, tokens, True))
+    index = (chunks, BM25([chunk[2] for chunk in chunks]), unindexed)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def compact_search_results(
+    search_results: Dict, user_question: str, budget_tokens: int, focus: str = ""
+) -> Tuple[str, dict]:
+    """Renders the search result chunks that fit into the token budget, most relevant first.
+
+    Chunks are ranked by BM25 against the question and `focus` (e.g. the current
+    critique); at most DEEP_TOP_K chunks of raw pages are taken. Chunks are grouped
+    by source in the prompt. Returns the text and statistics for the node message.
+    """
+    items, duplicates = _collect_items(search_results)
+    stats = {
+        "budget_tokens": budget_tokens,
+        "items": len(items),
+        "duplicates": duplicates,
+        "chunks": 0,
+        "chunks_used": 0,
+        "dropped": 0,
+        "unindexed": 0,
+        "truncated": 0,
+        "search_tokens": 0,
+    }
+    if not items:
+        return "", stats
+
+    chunks, bm25, stats["unindexed"] = _chunk_index(items)
+    stats["chunks"] = len(chunks)
+    selected = {}
+    page_chunks = 0
+    left = budget_tokens
+    for index in bm25.rank(tokenize(user_question + " " + focus)):
+        number, text, _, is_page_chunk = chunks[index]
+        if is_page_chunk and page_chunks >= DEEP_TOP_K:
+            stats["dropped"] += 1
+            continue
+        header = (
+            0
+            if number in selected
+            else estimate_tokens(
+                f"[00] {items[number]['title']}\n{items[number]['url']}\n"
+            )
+        )
+        tokens = header + estimate_tokens(text) + 1
+        if tokens > left:
+            if left - header < MIN_SNIPPET_TOKENS:
+                stats["dropped"] += 1
+                continue
+            text = text[: (left - header) * CHARS_PER_TOKEN]
+            tokens = left
+            stats["truncated"] += 1
+        selected.setdefault(number, []).append(text)
+        page_chunks += is_page_chunk
+        stats["chunks_used"] += 1
+        left -= tokens
+
+    parts = [
+        f"[{position}] {items[number]['title']}\n{items[number]['url']}\n"
+        + "\n...\n".join(texts)
+        for position, (number, texts) in enumerate(selected.items(), start=1)
+    ]
+    stats["search_tokens"] = budget_tokens - left
+    return "\n\n".join(parts), stats
@@ -0,0 +1,103 @@
+"""Early exit from the answer/critique loop.
+
+A rewrite is skipped when the revised draft barely differs from the previous one
+or the new critique repeats an earlier one; any further round is skipped when the
+request runs out of its time or token budget. Similarity is the Jaccard index of
+word shingles, with words cut to a stem as in BM25 ranking.
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+from context_budget import tokenize
+
+# The critic may ask for at most this many rounds (the graph checks len(critique) <= 3)
+MAX_CRITIQUES = 3
+
+CONVERGENCE_SHINGLE = int(os.getenv("CONVERGENCE_SHINGLE", "3"))
+# A revised draft at least this similar to the previous one is only a cosmetic change
+CONVERGENCE_DRAFT_SIMILARITY = float(os.getenv("CONVERGENCE_DRAFT_SIMILARITY", "0.85"))
+# A critique at least this similar to an earlier one repeats it
+CONVERGENCE_CRITIQUE_SIMILARITY = float(
+    os.getenv("CONVERGENCE_CRITIQUE_SIMILARITY", "0.6")
+)
+# Per-request limits that force the finalizer; empty for no limit
+RUN_TIME_BUDGET = float(os.getenv("RUN_TIME_BUDGET") or 0)
+RUN_TOKEN_BUDGET = int(os.getenv("RUN_TOKEN_BUDGET") or 0)
+
+
+def shingles(text: str, size: int = CONVERGENCE_SHINGLE) -> set:
+    words = tokenize(text)
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def similarity(a: str, b: str) -> float:
+    first, second = shingles(a), shingles(b)
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def repeats(text: str, earlier: Iterable[str]) -> float:
+    """Highest similarity of `text` to any of the earlier texts."""
+    return max((similarity(text, other) for other in earlier), default=0.0)
+
+
+def over_budget(run_started: Optional[float], run_tokens: int) -> Optional[str]:
+    """Name of the exhausted budget of the request, if any."""
+    if RUN_TIME_BUDGET and run_started and time.time() - run_started > RUN_TIME_BUDGET:
+        return "time_budget"
+    if RUN_TOKEN_BUDGET and run_tokens > RUN_TOKEN_BUDGET:
+        return "token_budget"
+    return None
+
+
+def converged(
+    previous_answer: str, last_answer: str, new_critique: str, earlier: list
+) -> Optional[str]:
+    """Why another rewrite would not pay off, or None.
+
+    `earlier` holds the critiques given before `new_critique`.
+    """
+    if (
+        previous_answer
+        and similarity(previous_answer, last_answer) >= CONVERGENCE_DRAFT_SIMILARITY
+    ):
+        return "draft_converged"
+    if repeats(new_critique, earlier) >= CONVERGENCE_CRITIQUE_SIMILARITY:
+        return "critique_repeated"
+    return None
+
+
+class ConvergenceStats:
+    """How often the loop was cut and how many rounds that saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stops = Counter()
+        self.iterations_saved = 0
+
+    def record(self, reason: str, critiques: int):
+        with self._lock:
+            self._stops[reason] += 1
+            # Rounds the critique limit would still have allowed
+            self.iterations_saved += max(0, MAX_CRITIQUES - critiques + 1)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "stops": dict(self._stops),
+                "iterations_saved": self.iterations_saved,
+            }
+
+
+CONVERGENCE_STATS = ConvergenceStats()
+
+
+def get_convergence_stats() -> dict:
+    return CONVERGENCE_STATS.as_dict()
@@ -0,0 +1,53 @@
+"""Final answer without the finalizer rewrite.
+
+When the critic approves the draft (`good`), FINALIZE_MODE decides what the
+finalizer does with it:
+- rewrite: writes the answer anew from the draft, critique and search results;
+- passthrough: returns the approved draft as is;
+- light: returns the draft with prompt markup and extra blank lines removed.
+"""
+
+import os
+import re
+
+from langchain_core.callbacks.manager import adispatch_custom_event
+
+FINALIZE_MODE = os.getenv("FINALIZE_MODE", "rewrite").lower()
+
+# Custom event carrying an answer that is not generated by a model, so the UI
+# renders it like streamed tokens
+FINAL_ANSWER_EVENT = "final_answer"
+
+# Section tags of the prompts in graph.py; other markup belongs to the answer
+PROMPT_TAGS = (
+    "THINK",
+    "LAST_ANSWER",
+    "SEARCH_RESULTS",
+    "CRITICUE",
+    "OLD_CRITIQUE",
+    "OLD_SEARCH_QUERY",
+    "HISTORY",
+)
+_MARKUP_RE = re.compile(r"<[/\\]?(?:%s)>" % "|".join(PROMPT_TAGS))
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def clean_answer(text: str) -> str:
+    """Drops section tags of the prompts that a draft may echo, and extra blank lines."""
+    text = _MARKUP_RE.sub("", text)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def approved_answer(state: dict):
+    """Text to return instead of the rewrite, or None when the finalizer must run."""
+    if FINALIZE_MODE not in ("passthrough", "light"):
+        return None
+    if state.get("final_decision") != "good" or not state.get("last_answer"):
+        return None
+    if FINALIZE_MODE == "light":
+        return clean_answer(state["last_answer"])
+    return state["last_answer"]
+
+
+async def emit_answer(text: str):
+    await adispatch_custom_event(FINAL_ANSWER_EVENT, {"chunk": text})
@@ -0,0 +1,75 @@
+import asyncio
+import weakref
+from typing import Any
+
+from langchain_gigachat import GigaChat
+from pydantic import PrivateAttr
+
+from models import GIGACHAT_BACKEND
+
+
+class PooledGigaChat(GigaChat):
+    """GigaChat whose async calls go through GIGACHAT_BACKEND.
+
+    The gigachat client holds a keep-alive connection pool and an asyncio token lock,
+    both bound to an event loop, while Streamlit runs every question in a new loop.
+    So one client is kept per running loop, and a new client takes over the access
+    token of the previous one instead of authenticating again.
+    """
+
+    _pool: Any = PrivateAttr(default_factory=weakref.WeakKeyDictionary)
+    _sync_client: Any = PrivateAttr(default=None)
+    _last_client: Any = PrivateAttr(default=None)
+
+    def _new_client(self):
+        import gigachat
+
+        client = gigachat.GigaChat(
+            base_url=self.base_url,
+            auth_url=self.auth_url,
+            credentials=self.credentials,
+            scope=self.scope,
+            access_token=self.access_token,
+            model=self.model,
+            profanity_check=self.profanity_check,
+            user=self.user,
+            password=self.password,
+            timeout=self.timeout,
+            ssl_context=self.ssl_context,
+            verify_ssl_certs=self.verify_ssl_certs,
+            ca_bundle_file=self.ca_bundle_file,
+            cert_file=self.cert_file,
+            key_file=self.key_file,
+            key_file_password=self.key_file_password,
+            verbose=self.verbose,
+            flags=self.flags,
+            max_connections=GIGACHAT_BACKEND.max_in_flight,
+        )
+        if self._last_client is not None:
+            client._access_token = self._last_client._access_token
+        self._last_client = client
+        return client
+
+    @property
+    def _client(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if self._sync_client is None:
+                self._sync_client = self._new_client()
+            return self._sync_client
+        client = self._pool.get(loop)
+        if client is None:
+            client = self._pool[loop] = self._new_client()
+        return client
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await GIGACHAT_BACKEND.call(
+            super()._agenerate, messages, stop=stop, run_manager=run_manager, **kwargs
+        )
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async for chunk in GIGACHAT_BACKEND.stream(
+            super()._astream, messages, stop=stop, run_manager=run_manager, **kwargs
+        ):
+            yield chunk
@@ -1,12 +1,43 @@
 from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
 from langgraph.graph import START, END, StateGraph, MessagesState
 from langgraph.graph.message import AnyMessage, add_messages
-from langchain_gigachat import GigaChat
-from langchain.prompts import ChatPromptTemplate
-from pydantic import BaseModel, Field
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field, field_validator
 from langgraph.types import Command
 from typing import List, Dict
-from tavily import TavilyClient
+from models import get_llm
+from sessions import compact_history, make_checkpointer
+from search import prefetch, search_many
+from streaming_json import astream_structured
+from speculation import (
+    SPECULATIVE_DRAFT,
+    SPECULATIVE_SEARCH,
+    SPECULATIVE_DRAFT_RUN,
+    SPECULATIVE_TAG,
+    Speculation,
+    collect_text,
+    covered_by,
+)
+from telemetry import TELEMETRY_PORT, instrument, start_server
+from context_budget import (
+    CONTEXT_BUDGETS,
+    compact_search_results,
+    estimate_prompt_tokens,
+    index_pages,
+    estimate_tokens,
+)
+from final_answer import FINALIZE_MODE, approved_answer, emit_answer
+from convergence import CONVERGENCE_STATS, converged, over_budget
+from self_consistency import (
+    SELF_CONSISTENCY_DRAFT_RUN,
+    SELF_CONSISTENCY_STATS,
+    SELF_CONSISTENCY_TAG,
+    draft_count,
+    draft_sampling,
+    gather_drafts,
+    select_draft,
+)
+import logging
 import time
 from typing_extensions import TypedDict
 from langchain_core.messages.tool import ToolMessage
@@ -14,38 +45,63 @@ from typing import Optional, Literal
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
 
+logger = logging.getLogger(__name__)
+
+
 class GraphsState(MessagesState):
     user_question: Optional[str] = ""
     last_reason: Optional[str] = ""
     last_answer: Optional[str] = ""
     critique: Optional[List[str]] = []
     final_decision: Optional[str] = ""
-    search_query: Optional[str] = ""
+    search_queries: Optional[List[str]] = []
     search_mode: Optional[str] = ""
     search_results: Optional[Dict] = {}
+    trace_id: Optional[str] = ""
+    previous_answer: Optional[str] = ""
+    run_started: Optional[float] = None
+    run_tokens: Optional[int] = 0
 
 
 graph = StateGraph(GraphsState)
 
-llm = GigaChat(
-    model="GigaChat-2-Max",
-    verify_ssl_certs=False,
-    profanity_check=False,
-    # base_url="https://gigachat.sberdevices.ru/v1",
-    streaming=True,
-    max_tokens=8000,
-    top_p=0,
-    # temperature=1,
-    timeout=600,
-)
-
-MAIN_TEMPLATE = f"""Ты - ИИ Ассистент на базе GigaChat.
+MAIN_TEMPLATE = """Ты - ИИ Ассистент на базе GigaChat.
 Твоя задача качественно ответить на вопрос пользователя.
-Сегодняшняя дата - {time.strftime('%Y-%m-%d')}
+Сегодняшняя дата - {current_date}
 Рассуждай шаг за шагом. Подумай о том, как ответить на вопрос пользователя наилучшим образом.
 
 """
 
+
+def current_date() -> str:
+    # Evaluated on every call: long-lived workers must not freeze the date at import
+    return time.strftime("%Y-%m-%d")
+
+
+def system_prompt(template: str, **partials) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([("system", template)]).partial(
+        current_date=current_date, **partials
+    )
+
+
+_chains = {}
+
+
+def node_chain(node: str, prompt: ChatPromptTemplate, **sampling):
+    """prompt | model | str parser, built once per node and sampling and reused.
+
+    The model is looked up on every call, so an override set after import
+    (benchmarks, replay) gets a chain of its own.
+    """
+    llm = get_llm(node)
+    key = (node, tuple(sorted(sampling.items())))
+    cached = _chains.get(key)
+    if cached is None or cached[0] is not llm:
+        model = llm.bind(**sampling) if sampling else llm
+        cached = _chains[key] = (llm, prompt | model | StrOutputParser())
+    return cached[1]
+
+
 REASONER_TEMPLATE = (
     MAIN_TEMPLATE
     + """Думай как аналитик, который обдумывает вопрос пользователя перед тем, как начать отвечать на него.
@@ -60,42 +116,77 @@ REASONER_TEMPLATE = (
 Если пользователь дает тебе задачу - решай ее аналитически.
 Если пользователь просит тебя сделать операцию с буквами в словах, то имей в виду - ты плохо считаешь буквы, это твоя слабая сторона, поэтому действуй очень аккуратно.  Распиши слово по буквам: одна строка - одна буква и напиши свои мысли про каждую из букв! Подумай над каждой буквой, а потом отвечай.
 
+История разговора (если есть):
+<HISTORY>
+{history}
+</HISTORY>
+Если вопрос продолжает разговор, явно опиши в своих мыслях, о чем идет речь - остальные агенты видят только твои мысли, а не историю.
+
 Вопрос пользователя - {user_question}
 """
 )
 
+REASONER_PROMPT = system_prompt(REASONER_TEMPLATE)
+
 
-def reason(state: GraphsState):
+async def reason(state: GraphsState):
     user_question = state["messages"][-1].content
 
-    prompt = ChatPromptTemplate.from_messages([("system", REASONER_TEMPLATE)])
+    chain = node_chain("reason", REASONER_PROMPT)
 
-    chain = prompt | llm | StrOutputParser()
+    history, stale_messages = compact_history(state["messages"])
 
-    res = chain.invoke({"user_question": user_question})
+    inputs = {"user_question": user_question, "history": history}
+    res = await chain.ainvoke(inputs)
 
     return {
         "user_question": user_question,
         "last_reason": res,
-        "messages": ToolMessage(tool_call_id="1", name="🤔 thinking", content=res),
+        "messages": stale_messages
+        + [ToolMessage(tool_call_id="1", name="🤔 thinking", content=res)],
         "last_answer": "",
         "critique": [],
         "final_decision": "",
-        "search_query": "",
+        "search_queries": [],
         "search_mode": "",
         "search_results": {},
+        "previous_answer": "",
+        "run_started": time.time(),
+        # The budget of the request starts with its reasoning call
+        "run_tokens": estimate_prompt_tokens(REASONER_PROMPT, inputs)
+        + estimate_tokens(res),
     }
 
 
+SEARCH_QUERIES_DESCRIPTION = (
+    "Список поисковых запросов на поиск данных в интернете, если нужен. "
+    "Если нужно найти данные о нескольких объектах - сделай отдельный запрос для каждого, "
+    "они будут выполнены параллельно"
+)
+
+
+def coerce_search_queries(value):
+    """Models sometimes answer with a single string instead of a list."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    return [query for query in value if isinstance(query, str) and query.strip()]
+
+
 class FirstStep(BaseModel):
     """Описание первого шага для ответа на вопрос пользователя"""
 
-    search_query: str = Field(
-        description="Текст поискового запроса на поиск данных в интернете, если нужен"
-    )
+    # Routing fields go first so the graph can act on them while the rest streams
     final_decision: str = Field(
         description="Итоговое решение, должно быть одно из следующих: "
     )
+    search_queries: List[str] = Field(description=SEARCH_QUERIES_DESCRIPTION)
+
+    @field_validator("search_queries", mode="before")
+    @classmethod
+    def validate_search_queries(cls, value):
+        return coerce_search_queries(value)
 
 
 FIRST_STEP_TEMPLATE = (
@@ -122,44 +213,156 @@ FIRST_STEP_TEMPLATE = (
 {format_instructions}"""
 )
 
+FIRST_STEP_PROMPT = system_prompt(
+    FIRST_STEP_TEMPLATE,
+    format_instructions=PydanticOutputParser(
+        pydantic_object=FirstStep
+    ).get_format_instructions(),
+)
 
-def first_step(
-    state: GraphsState,
-) -> Command[Literal["🔍 Searcher", "🏁 finalizing", "👨 answering"]]:
-    parser = PydanticOutputParser(pydantic_object=FirstStep)
-    prompt = ChatPromptTemplate.from_messages(
-        [("system", FIRST_STEP_TEMPLATE)]
-    ).partial(format_instructions=parser.get_format_instructions())
 
-    chain = prompt | llm | parser
+def search_prefetcher(needs_mode: bool):
+    """`on_field` callback that starts the search as soon as the routing fields are parsed.
+
+    The Searcher node then joins the requests already in flight.
+    """
+    fields = {}
+
+    def on_field(name, value):
+        fields[name] = value
+        if fields.get("final_decision") != "search" or "started" in fields:
+            return
+        if "search_queries" not in fields or (
+            needs_mode and "search_mode" not in fields
+        ):
+            return
+        queries = coerce_search_queries(fields["search_queries"])
+        if queries:
+            fields["started"] = True
+            prefetch(queries, fields.get("search_mode", "basic"))
+
+    return on_field
+
+
+def start_speculations(state: GraphsState) -> dict:
+    """Starts the draft answer and a guessed search while the router is thinking."""
+    speculations = {}
+    if SPECULATIVE_DRAFT:
+        chain, inputs, context_stats = answer_chain(state)
+        chunks = []
+        chain = chain.with_config(
+            run_name=SPECULATIVE_DRAFT_RUN, tags=[SPECULATIVE_TAG]
+        )
+        speculations["draft"] = Speculation(
+            "draft", collect_text(chain, inputs, chunks), chunks, context_stats
+        )
+    if SPECULATIVE_SEARCH:
+        speculations["search"] = Speculation(
+            "search", search_many([state["user_question"]], "basic")
+        )
+    return speculations
 
-    res = chain.invoke(
-        {
-            "user_question": state["user_question"],
-            "last_reason": state["last_reason"],
-        }
-    )
+
+async def first_step(
+    state: GraphsState,
+) -> Command[
+    Literal["🔍 Searcher", "🏁 finalizing", "👨 answering", "👨‍⚖️ self-criticque"]
+]:
+    chain = node_chain("first_step", FIRST_STEP_PROMPT)
+
+    speculations = start_speculations(state)
+    prefetch_search = search_prefetcher(needs_mode=False)
+
+    def on_field(name, value):
+        if name == "final_decision" and value != "writer" and "draft" in speculations:
+            # No need to wait for the end of the JSON to stop a useless draft
+            speculations.pop("draft").discard()
+        prefetch_search(name, value)
+
+    inputs = {
+        "user_question": state["user_question"],
+        "last_reason": state["last_reason"],
+    }
+    stats = {}
+    try:
+        res = await astream_structured(
+            chain,
+            inputs,
+            FirstStep,
+            llm=get_llm("first_step"),
+            on_field=on_field,
+            stats=stats,
+        )
+    except BaseException:
+        for speculation in speculations.values():
+            speculation.discard()
+        raise
 
     final_decision = res.final_decision
-    search_query = res.search_query
+    search_queries = res.search_queries
+    messages = [
+        ToolMessage(tool_call_id="1", name="1️⃣ first step think", content=res)
+    ]
     update = {
         "final_decision": final_decision,
-        "search_query": search_query,
-        "messages": ToolMessage(
-            tool_call_id="1", name="1️⃣ first step think", content=res
-        ),
+        "search_queries": search_queries,
+        "messages": messages,
+        "run_tokens": (state.get("run_tokens") or 0)
+        + estimate_prompt_tokens(FIRST_STEP_PROMPT, inputs)
+        + estimate_tokens(res.model_dump_json())
+        + stats.get("repair_tokens", 0),
     }
     goto = "🏁 finalizing"
 
-    if (
-        final_decision == "search"
-        and search_query is not None
-        and len(search_query) > 0
-    ):
+    if final_decision == "search" and search_queries:
         goto = "🔍 Searcher"
     if final_decision == "writer":
         goto = "👨 answering"
 
+    draft = speculations.get("draft")
+    if draft is not None and goto == "👨 answering":
+        del speculations["draft"]
+        last_answer = await draft.accept()
+        update["last_answer"] = last_answer
+        update["run_tokens"] += draft.metadata["prompt_tokens"] + estimate_tokens(
+            last_answer
+        )
+        messages.append(
+            ToolMessage(
+                tool_call_id="1",
+                name="👨 answering",
+                content=last_answer,
+                artifact=draft.metadata,
+            )
+        )
+        goto = "👨‍⚖️ self-criticque"
+
+    # A guessed search that is not used stays in `speculations` to be discarded
+    guessed_search = speculations.get("search")
+    if guessed_search is not None and goto == "🔍 Searcher":
+        covered = [
+            query
+            for query in search_queries
+            if covered_by(query, state["user_question"])
+        ]
+        if covered:
+            responses, _, _ = await guessed_search.peek()
+            if responses:
+                del speculations["search"]
+                await guessed_search.accept()
+                update["search_results"] = {
+                    **state.get("search_results", {}),
+                    **responses,
+                }
+                update["search_queries"] = [
+                    query for query in search_queries if query not in covered
+                ]
+                if not update["search_queries"]:
+                    goto = "👨 answering"
+
+    for speculation in speculations.values():
+        speculation.discard()
+
     return Command(update=update, goto=goto)
 
 
@@ -185,23 +388,77 @@ ANSWER_TEMPLATE = (
 """
 )
 
+ANSWER_PROMPT = system_prompt(ANSWER_TEMPLATE)
 
-def answer(state: GraphsState):
-    prompt = ChatPromptTemplate.from_messages([("system", ANSWER_TEMPLATE)])
 
-    chain = prompt | llm | StrOutputParser()
+def search_context(state: GraphsState, node: str):
+    """Search results compacted to the node's token budget, plus compaction stats.
 
-    res = chain.invoke(
-        {
-            "user_question": state["user_question"],
-            "last_reason": state["last_reason"],
-            "search_results": state.get("search_results", {}),
-        }
+    Chunks are picked for the question and the latest critique, so each iteration
+    gets the parts of deep search pages that matter for what is being fixed.
+    """
+    critique = state.get("critique") or []
+    return compact_search_results(
+        state.get("search_results", {}),
+        state["user_question"],
+        CONTEXT_BUDGETS[node],
+        focus=critique[-1] if critique else "",
     )
 
+
+def answer_chain(state: GraphsState):
+    """Chain, inputs and context stats of the answer node for this state."""
+    chain = node_chain("answer", ANSWER_PROMPT)
+
+    search_results, context_stats = search_context(state, "answer")
+    inputs = {
+        "user_question": state["user_question"],
+        "last_reason": state["last_reason"],
+        "search_results": search_results,
+    }
+    context_stats["prompt_tokens"] = estimate_prompt_tokens(ANSWER_PROMPT, inputs)
+    return chain, inputs, context_stats
+
+
+async def self_consistent_answer(state: GraphsState, inputs: dict, count: int):
+    """Writes `count` drafts concurrently and returns the winner, all drafts and the choice."""
+
+    async def draft(index):
+        chain = node_chain("answer", ANSWER_PROMPT, **draft_sampling(index))
+        chain = chain.with_config(
+            run_name=SELF_CONSISTENCY_DRAFT_RUN, tags=[SELF_CONSISTENCY_TAG]
+        )
+        return await chain.ainvoke(inputs)
+
+    drafts = await gather_drafts(draft, count)
+    winner, details = select_draft(state["user_question"], drafts)
+    SELF_CONSISTENCY_STATS.record(details)
+    # The drafts are hidden from the UI, so the winner is shown as the node's output
+    await emit_answer(drafts[winner])
+    return drafts[winner], drafts, dict(details, winner=winner)
+
+
+async def answer(state: GraphsState):
+    chain, inputs, context_stats = answer_chain(state)
+
+    count = draft_count(state["user_question"])
+    if count > 1:
+        res, drafts, context_stats["self_consistency"] = await self_consistent_answer(
+            state, inputs, count
+        )
+    else:
+        res = await chain.ainvoke(inputs)
+        drafts = [res]
+
     return {
         "last_answer": res,
-        "messages": ToolMessage(tool_call_id="1", name="👨 answering", content=res),
+        "previous_answer": state.get("last_answer") or "",
+        "run_tokens": (state.get("run_tokens") or 0)
+        + len(drafts) * context_stats["prompt_tokens"]
+        + sum(estimate_tokens(text) for text in drafts),
+        "messages": ToolMessage(
+            tool_call_id="1", name="👨 answering", content=res, artifact=context_stats
+        ),
     }
 
 
@@ -209,22 +466,26 @@ class Critique(BaseModel):
     """Критика выступления"""
 
     thoughts: str = Field(description="Мысли по поводу ответа")
-    critique: str = Field(
-        description="Конструктивная критика ответа - что нужно поправить или доработать"
-    )
-    is_new_critique: bool = Field(
-        description="Содержит ли твоя критика что-то принципиально новое или подобная критика уже была дана раньше"
-    )
-    search_query: str = Field(
-        description="Текст поискового запроса на поиск данных в интернете, если нужен"
+    # Routing fields go before the long critique text so the search can start early
+    final_decision: str = Field(
+        description="Итоговое решение, должно быть одно из следующих: good (если нет новой критики, есть отрывки из книг и речь можно считать написаной), search (требуется поиск данных в интернете), fix (если требуется переписать или доработать ответ)"
     )
+    search_queries: List[str] = Field(description=SEARCH_QUERIES_DESCRIPTION)
     search_mode: str = Field(
         description="Режим поиска - basic (простой поиск) или deep (глубокий поиск). Используй простой поиск, когда тебе нужно найти ответ на вопрос и глубокий поиск, когда нужно загрузить много подробной информации. Используй глубокий поиск только в случае, когда ты уже попробовал простой поиск."
     )
-    final_decision: str = Field(
-        description="Итоговое решение, должно быть одно из следующих: good (если нет новой критики, есть отрывки из книг и речь можно считать написаной), search (требуется поиск данных в интернете), fix (если требуется переписать или доработать ответ)"
+    is_new_critique: bool = Field(
+        description="Содержит ли твоя критика что-то принципиально новое или подобная критика уже была дана раньше"
+    )
+    critique: str = Field(
+        description="Конструктивная критика ответа - что нужно поправить или доработать"
     )
 
+    @field_validator("search_queries", mode="before")
+    @classmethod
+    def validate_search_queries(cls, value):
+        return coerce_search_queries(value)
+
 
 CRITIQUE_TEMPLATE = (
     MAIN_TEMPLATE
@@ -253,7 +514,7 @@ CRITIQUE_TEMPLATE = (
 
 Предыдущие поисковые запросы (если есть):
 <OLD_SEARCH_QUERY>
-{old_search_query}
+{old_search_queries}
 </OLD_SEARCH_QUERY>
 
 Результаты поиска (если есть):
@@ -265,54 +526,78 @@ CRITIQUE_TEMPLATE = (
 {format_instructions}"""
 )
 
+CRITIQUE_PROMPT = system_prompt(
+    CRITIQUE_TEMPLATE,
+    format_instructions=PydanticOutputParser(
+        pydantic_object=Critique
+    ).get_format_instructions(),
+)
+
 
-def critique(
+async def critique(
     state: GraphsState,
 ) -> Command[Literal["🔍 Searcher", "🏁 finalizing", "👨 answering"]]:
-    parser = PydanticOutputParser(pydantic_object=Critique)
-    prompt = ChatPromptTemplate.from_messages([("system", CRITIQUE_TEMPLATE)]).partial(
-        format_instructions=parser.get_format_instructions()
-    )
-
-    chain = prompt | llm | parser
+    chain = node_chain("critique", CRITIQUE_PROMPT)
+
+    search_results, context_stats = search_context(state, "critique")
+    inputs = {
+        "user_question": state["user_question"],
+        "last_reason": state["last_reason"],
+        "last_answer": state["last_answer"],
+        "critique": state.get("critique", []),
+        "old_search_queries": list(state.get("search_results", {}).keys()),
+        "search_results": search_results,
+    }
+    context_stats["prompt_tokens"] = estimate_prompt_tokens(CRITIQUE_PROMPT, inputs)
 
-    res = chain.invoke(
-        {
-            "user_question": state["user_question"],
-            "last_reason": state["last_reason"],
-            "last_answer": state["last_answer"],
-            "critique": state.get("critique", []),
-            "old_search_query": state.get("search_query", ""),
-            "search_results": state.get("search_results", {}),
-        }
+    # Past the critique limit the graph finalizes anyway, so there is nothing to prefetch
+    on_field = (
+        search_prefetcher(needs_mode=True)
+        if len(state.get("critique") or []) < 3
+        else None
+    )
+    res = await astream_structured(
+        chain,
+        inputs,
+        Critique,
+        llm=get_llm("critique"),
+        on_field=on_field,
+        stats=context_stats,
     )
     new_critique_str = res.critique
     final_decision = res.final_decision
-    search_query = res.search_query
+    search_queries = res.search_queries
     is_new_critique = res.is_new_critique
     search_mode = res.search_mode
 
     critique = state.get("critique", [])
     if critique is None:
         critique = []
+    earlier_critique = list(critique)
     critique.append(new_critique_str)
+    run_tokens = (
+        (state.get("run_tokens") or 0)
+        + context_stats["prompt_tokens"]
+        + estimate_tokens(res.model_dump_json())
+        + context_stats.get("repair_tokens", 0)
+    )
 
     update = {
         "final_decision": final_decision,
         "critique": critique,
-        "search_query": search_query,
+        "run_tokens": run_tokens,
+        "search_queries": search_queries,
         "search_mode": search_mode,
         "messages": ToolMessage(
-            tool_call_id="1", name="👨‍⚖️ self-criticque", content=res
+            tool_call_id="1",
+            name="👨‍⚖️ self-criticque",
+            content=res,
+            artifact=context_stats,
         ),
     }
     goto = "🏁 finalizing"
 
-    if (
-        final_decision == "search"
-        and search_query is not None
-        and len(search_query) > 0
-    ):
+    if final_decision == "search" and search_queries:
         if len(critique) <= 3:
             goto = "🔍 Searcher"
 
@@ -320,7 +605,22 @@ def critique(
         if is_new_critique and len(critique) <= 3:
             goto = "👨 answering"
         else:
-            print("No new critique, go to finalizer")
+            logger.info("No new critique, go to finalizer")
+            goto = "🏁 finalizing"
+
+    if goto != "🏁 finalizing":
+        stopped = over_budget(state.get("run_started"), run_tokens)
+        if not stopped and goto == "👨 answering":
+            stopped = converged(
+                state.get("previous_answer"),
+                state["last_answer"],
+                new_critique_str,
+                earlier_critique,
+            )
+        if stopped:
+            logger.info("Loop stopped early (%s), go to finalizer", stopped)
+            CONVERGENCE_STATS.record(stopped, len(critique))
+            context_stats["stopped"] = stopped
             goto = "🏁 finalizing"
 
     return Command(update=update, goto=goto)
@@ -357,53 +657,65 @@ FINALIZER_TEMPLATE = (
 """
 )
 
+FINALIZER_PROMPT = system_prompt(FINALIZER_TEMPLATE)
 
-def finalize(state: GraphsState):
-    prompt = ChatPromptTemplate.from_messages([("system", FINALIZER_TEMPLATE)])
 
-    chain = prompt | llm | StrOutputParser()
-
-    res = chain.invoke(
-        {
-            "user_question": state["user_question"],
-            "last_reason": state.get("last_reason", None),
-            "critique": state.get("critique", None),
-            "last_answer": state.get("last_answer", None),
-            "search_results": state.get("search_results", {}),
+async def finalize(state: GraphsState):
+    approved = approved_answer(state)
+    if approved is not None:
+        await emit_answer(approved)
+        return {
+            "messages": AIMessage(
+                content=approved, response_metadata={"finalize": FINALIZE_MODE}
+            )
         }
-    )
 
-    return {"messages": AIMessage(content=res)}
+    chain = node_chain("finalize", FINALIZER_PROMPT)
+
+    search_results, context_stats = search_context(state, "finalize")
+    inputs = {
+        "user_question": state["user_question"],
+        "last_reason": state.get("last_reason", None),
+        "critique": state.get("critique", None),
+        "last_answer": state.get("last_answer", None),
+        "search_results": search_results,
+    }
+    context_stats["prompt_tokens"] = estimate_prompt_tokens(FINALIZER_PROMPT, inputs)
 
+    res = await chain.ainvoke(inputs)
 
-def search(state: GraphsState):
-    tavily_client = TavilyClient()
+    return {
+        "messages": AIMessage(content=res, response_metadata={"context": context_stats})
+    }
+
+
+async def search(state: GraphsState):
     search_mode = state.get("search_mode", "basic")
-    if search_mode == "deep":
-        response = tavily_client.search(
-            state["search_query"], search_depth="advanced", include_raw_content=True
-        )
-    else:
-        response = tavily_client.search(state["search_query"])
+    queries = state.get("search_queries", [])
+    responses, errors, cached = await search_many(queries, search_mode)
+    # Raw pages of deep search are chunked once here, not by every prompt that uses them
+    index_pages(responses)
 
     search_results = state.get("search_results", {})
-    search_results[state["search_query"]] = response
+    search_results.update(responses)
+
+    content = f"Searching... queries: {', '.join(queries)}, mode: {search_mode}"
+    if cached:
+        content += f", cached: {len(cached)}"
+    if errors:
+        content += f", failed: {'; '.join(f'{q} ({e})' for q, e in errors.items())}"
     return {
         "search_results": search_results,
-        "messages": ToolMessage(
-            tool_call_id="1",
-            name="🔍 Searcher",
-            content=f"Searching... query: {state['search_query']}, mode: {search_mode}",
-        ),
+        "messages": ToolMessage(tool_call_id="1", name="🔍 Searcher", content=content),
     }
 
 
-graph.add_node("🤔 thinking", reason)
-graph.add_node("1️⃣ first step think", first_step)
-graph.add_node("👨 answering", answer)
-graph.add_node("👨‍⚖️ self-criticque", critique)
-graph.add_node("🔍 Searcher", search)
-graph.add_node("🏁 finalizing", finalize)
+graph.add_node("🤔 thinking", instrument("reason", reason, starts_trace=True))
+graph.add_node("1️⃣ first step think", instrument("first_step", first_step))
+graph.add_node("👨 answering", instrument("answer", answer))
+graph.add_node("👨‍⚖️ self-criticque", instrument("critique", critique))
+graph.add_node("🔍 Searcher", instrument("search", search))
+graph.add_node("🏁 finalizing", instrument("finalize", finalize))
 
 
 graph.add_edge(START, "🤔 thinking")
@@ -413,4 +725,9 @@ graph.add_edge("🔍 Searcher", "👨 answering")
 graph.add_edge("🏁 finalizing", END)
 
 
-graph_runnable = graph.compile()
+graph_runnable = graph.compile(checkpointer=make_checkpointer())
+# The langgraph API server persists threads itself and rejects a custom checkpointer
+graph_api_runnable = graph.compile()
+
+if TELEMETRY_PORT:
+    start_server(TELEMETRY_PORT)
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import os
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from cache import make_cache
+
+LLM_CACHE = make_cache("LLM_CACHE", default_path="llm_cache.sqlite")
+
+# Nodes whose responses may be reused; prompts of the others change on every call anyway
+LLM_CACHE_NODES = {
+    node.strip()
+    for node in os.getenv("LLM_CACHE_NODES", "reason,first_step").split(",")
+    if node.strip()
+}
+
+# Characters per chunk when a cached response is replayed as a token stream
+REPLAY_CHUNK_SIZE = int(os.getenv("LLM_CACHE_REPLAY_CHUNK", "16"))
+
+
+def is_deterministic(llm, **kwargs) -> bool:
+    """Only greedy decoding makes a cached response as good as a fresh one.
+
+    Sampling parameters bound to a call (`kwargs`) override the client's.
+    """
+    top_p = kwargs.get("top_p", getattr(llm, "top_p", None))
+    temperature = kwargs.get("temperature", getattr(llm, "temperature", None))
+    return top_p == 0 or temperature == 0
+
+
+class CachedChatModel(BaseChatModel):
+    """Serves repeated prompts of a deterministic chat model from a cache.
+
+    The key covers the model name, generation parameters and rendered messages.
+    Cached responses are replayed in chunks, so streaming consumers still get
+    `on_chat_model_stream` events.
+    """
+
+    inner: BaseChatModel
+    response_cache: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cached-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.inner._identifying_params
+
+    def _key(
+        self, messages: List[BaseMessage], stop: Optional[List[str]], **kwargs
+    ) -> Optional[str]:
+        """Cache key of the call, or None for a call that samples."""
+        if not is_deterministic(self.inner, **kwargs):
+            return None
+        llm_string = self.inner._get_llm_string(stop=stop, **kwargs)
+        return hashlib.sha256((llm_string + dumps(messages)).encode()).hexdigest()
+
+    def _replay(self, text: str) -> Iterator[ChatGenerationChunk]:
+        for i in range(0, len(text), REPLAY_CHUNK_SIZE) or [0]:
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(content=text[i : i + REPLAY_CHUNK_SIZE])
+            )
+
+    def _result(self, text: str) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = self._key(messages, stop, **kwargs)
+        cached = self.response_cache.get(key) if key else None
+        if cached is not None:
+            return self._result(cached["text"])
+        if self.inner.rate_limiter:
+            self.inner.rate_limiter.acquire()
+        result = self.inner._generate(messages, stop=stop, **kwargs)
+        if key:
+            self.response_cache.set(key, {"text": result.generations[0].text})
+        return result
+
+    async def _agenerate(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> ChatResult:
+        key = self._key(messages, stop, **kwargs)
+        cached = self.response_cache.get(key) if key else None
+        if cached is not None:
+            return self._result(cached["text"])
+        if self.inner.rate_limiter:
+            await self.inner.rate_limiter.aacquire()
+        result = await self.inner._agenerate(messages, stop=stop, **kwargs)
+        if key:
+            self.response_cache.set(key, {"text": result.generations[0].text})
+        return result
+
+    def _stream(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> Iterator[ChatGenerationChunk]:
+        key = self._key(messages, stop, **kwargs)
+        cached = self.response_cache.get(key) if key else None
+        if cached is not None:
+            yield from self._replay(cached["text"])
+            return
+        if self.inner.rate_limiter:
+            self.inner.rate_limiter.acquire()
+        text = ""
+        for chunk in self.inner._stream(messages, stop=stop, **kwargs):
+            text += chunk.text
+            yield chunk
+        # Only a stream that ran to the end is stored
+        if key:
+            self.response_cache.set(key, {"text": text})
+
+    async def _astream(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        key = self._key(messages, stop, **kwargs)
+        cached = self.response_cache.get(key) if key else None
+        if cached is not None:
+            for chunk in self._replay(cached["text"]):
+                # Let the consumers render each replayed chunk
+                await asyncio.sleep(0)
+                yield chunk
+            return
+        # Calling the inner model directly skips its rate limiter, so it is applied here
+        if self.inner.rate_limiter:
+            await self.inner.rate_limiter.aacquire()
+        text = ""
+        async for chunk in self.inner._astream(messages, stop=stop, **kwargs):
+            text += chunk.text
+            yield chunk
+        if key:
+            self.response_cache.set(key, {"text": text})
+
+
+def with_response_cache(llm: BaseChatModel, node: str) -> BaseChatModel:
+    """Wraps the node's model in the response cache if the node is cacheable."""
+    if LLM_CACHE is None or node not in LLM_CACHE_NODES or not is_deterministic(llm):
+        return llm
+    return CachedChatModel(inner=llm, response_cache=LLM_CACHE, callbacks=llm.callbacks)
+
+
+def get_llm_cache_stats() -> dict:
+    return LLM_CACHE.stats() if LLM_CACHE is not None else {}
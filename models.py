@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from backends import make_backend
+from context_budget import estimate_tokens
+from llm_cache import with_response_cache
+
+DEFAULT_MODEL = {"model": "GigaChat-2-Max", "max_tokens": 8000}
+
+# Control calls only pick a route and a query, so they run on a lighter tier
+DEFAULT_MODEL_MAP = {
+    "reason": DEFAULT_MODEL,
+    "first_step": {"model": "GigaChat-2", "max_tokens": 512},
+    "answer": DEFAULT_MODEL,
+    "critique": {"model": "GigaChat-2", "max_tokens": 2048},
+    "finalize": DEFAULT_MODEL,
+}
+
+
+def load_model_map() -> dict:
+    """Per-node model settings: defaults overridden by the LLM_MODEL_MAP JSON env var.
+
+    Example: LLM_MODEL_MAP={"first_step": {"model": "GigaChat-2-Pro", "max_tokens": 256}}
+    """
+    model_map = {node: dict(settings) for node, settings in DEFAULT_MODEL_MAP.items()}
+    overrides = json.loads(os.getenv("LLM_MODEL_MAP") or "{}")
+    for node, settings in overrides.items():
+        model_map[node] = {**model_map.get(node, DEFAULT_MODEL), **settings}
+    return model_map
+
+
+MODEL_MAP = load_model_map()
+
+
+# Requests per second, in-flight cap, retries and circuit breaker of GigaChat (GIGACHAT_* env)
+GIGACHAT_BACKEND = make_backend("GIGACHAT", max_in_flight=16)
+
+
+class UsageRecorder(BaseCallbackHandler):
+    """Collects per-node LLM latency and token counts.
+
+    GigaChat does not report usage when streaming, so missing counts are estimated
+    from the text.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs = {}
+        self._usage = defaultdict(
+            lambda: {
+                "calls": 0,
+                "latency": 0.0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            }
+        )
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, metadata=None, **kwargs
+    ):
+        node = (metadata or {}).get("langgraph_node")
+        prompt_tokens = sum(
+            estimate_tokens(str(message.content))
+            for batch in messages
+            for message in batch
+        )
+        self._runs[run_id] = (node, time.perf_counter(), prompt_tokens)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        node, start, prompt_tokens = run
+        text = "".join(
+            generation.text
+            for generations in response.generations
+            for generation in generations
+        )
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        with self._lock:
+            usage = self._usage[node]
+            usage["calls"] += 1
+            usage["latency"] += time.perf_counter() - start
+            usage["prompt_tokens"] += token_usage.get("prompt_tokens", prompt_tokens)
+            usage["completion_tokens"] += token_usage.get(
+                "completion_tokens", estimate_tokens(text)
+            )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {node: dict(usage) for node, usage in self._usage.items()}
+
+
+USAGE_RECORDER = UsageRecorder()
+
+_clients = {}
+_llms = {}
+_override = None
+
+
+def get_node_usage() -> dict:
+    return USAGE_RECORDER.as_dict()
+
+
+def set_llm_override(llm: Optional[object]):
+    """Makes every node use `llm`, e.g. a stub in benchmarks. None restores the model map."""
+    global _override
+    _override = llm
+
+
+def get_client(node: str):
+    """GigaChat client with the node's settings, without the response cache.
+
+    Clients with equal settings are shared. The GigaChat SDK is imported on first
+    use, which keeps it out of the import time of the graph.
+    """
+    from gigachat_client import PooledGigaChat
+
+    settings = MODEL_MAP.get(node, DEFAULT_MODEL)
+    key = tuple(sorted(settings.items()))
+    if key not in _clients:
+        _clients[key] = PooledGigaChat(
+            verify_ssl_certs=False,
+            profanity_check=False,
+            # base_url="https://gigachat.sberdevices.ru/v1",
+            streaming=True,
+            top_p=0,
+            # temperature=1,
+            timeout=600,
+            callbacks=[USAGE_RECORDER],
+            **settings,
+        )
+    return _clients[key]
+
+
+def get_llm(node: str):
+    """Chat model for the node."""
+    if _override is not None:
+        return _override
+    if node not in _llms:
+        _llms[node] = with_response_cache(get_client(node), node)
+    return _llms[node]
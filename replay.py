@@ -0,0 +1,194 @@
+"""Record and replay of LLM streams and Tavily responses for offline runs of the graph.
+
+A fixture holds one question with the model calls grouped by the prompt role that
+made them (reason, first_step, ...) and the search responses by cache key. Calls
+are either recorded chunks with time offsets, or a text with a synthetic timing
+(`ttft` seconds to the first chunk, then `tokens_per_second`).
+"""
+
+import asyncio
+import json
+import time
+from contextlib import contextmanager
+from typing import Any, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+import models
+import search
+from context_budget import CHARS_PER_TOKEN
+
+# Prompt roles are told apart by the persona each template gives the model
+ROLE_MARKERS = [
+    ("агент-координатор", "first_step"),
+    ("агент-критик", "critique"),
+    ("агент-помощник", "answer"),
+    ("агент-выпускающий редактор", "finalize"),
+    ("аналитик", "reason"),
+    ("Исправь JSON", "repair"),
+]
+
+
+def prompt_role(messages: List[BaseMessage]) -> str:
+    """Role of the template that rendered the prompt.
+
+    The persona comes before any inserted text, so the earliest marker wins.
+    """
+    prompt = messages[0].content if messages else ""
+    found = [
+        (prompt.find(marker), role) for marker, role in ROLE_MARKERS if marker in prompt
+    ]
+    return min(found)[1] if found else "other"
+
+
+def call_chunks(call: dict) -> List[list]:
+    """[offset, text] pairs of a recorded or synthetic call."""
+    if "chunks" in call:
+        return call["chunks"]
+    text = call["text"]
+    step = CHARS_PER_TOKEN / call.get("tokens_per_second", 50)
+    offset = call.get("ttft", 0.0)
+    chunks = []
+    for i in range(0, len(text), CHARS_PER_TOKEN):
+        chunks.append([offset, text[i : i + CHARS_PER_TOKEN]])
+        offset += step
+    return chunks
+
+
+def load_fixture(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_fixture(fixture: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(fixture, f, ensure_ascii=False, indent=1)
+
+
+class RecordingChatModel(BaseChatModel):
+    """Streams from the real client of the prompt's role and records chunk timings."""
+
+    fixture: dict
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        role = prompt_role(messages)
+        inner = models.get_client(role)
+        chunks = []
+        start = time.perf_counter()
+        async for chunk in inner._astream(messages, stop=stop, **kwargs):
+            chunks.append([round(time.perf_counter() - start, 4), chunk.text])
+            yield chunk
+        self.fixture["llm"].setdefault(role, []).append({"chunks": chunks})
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = ""
+        async for chunk in self._astream(messages, stop=stop, **kwargs):
+            text += chunk.text
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError("Recording is async only")
+
+
+class ReplayChatModel(BaseChatModel):
+    """Serves the fixture's calls of each role in order; the last one repeats.
+
+    `speed` scales the recorded timings, 0 replays without delays.
+    """
+
+    fixture: dict
+    speed: float = 1.0
+    positions: dict = Field(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _next_call(self, messages, **kwargs) -> dict:
+        """The next call of the prompt's role; `kwargs` are the call's bound parameters."""
+        role = prompt_role(messages)
+        calls = self.fixture["llm"].get(role)
+        if not calls:
+            raise KeyError(f"Fixture has no {role} calls: {self.fixture['question']}")
+        position = self.positions.get(role, 0)
+        self.positions[role] = position + 1
+        return calls[min(position, len(calls) - 1)]
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        previous = 0.0
+        for offset, text in call_chunks(self._next_call(messages, **kwargs)):
+            if self.speed:
+                await asyncio.sleep((offset - previous) / self.speed)
+            previous = offset
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = ""
+        async for chunk in self._astream(messages, stop=stop, **kwargs):
+            text += chunk.text
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = "".join(
+            text for _, text in call_chunks(self._next_call(messages, **kwargs))
+        )
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+def recording_search(fixture: dict):
+    async def record(query: str, mode: str) -> dict:
+        start = time.perf_counter()
+        response = await search.tavily_search(query, mode)
+        fixture["search"][search.cache_key(query, mode)] = {
+            "latency": round(time.perf_counter() - start, 4),
+            "response": response,
+        }
+        return response
+
+    return record
+
+
+def replay_search(fixture: dict, speed: float = 1.0):
+    async def replay(query: str, mode: str) -> Any:
+        recorded = fixture["search"].get(search.cache_key(query, mode))
+        if recorded is None:
+            recorded = fixture["search"].get(search.cache_key(query, "deep"))
+        if recorded is None:
+            return {"query": query, "results": []}
+        if speed:
+            await asyncio.sleep(recorded.get("latency", 0.0) / speed)
+        return recorded["response"]
+
+    return replay
+
+
+@contextmanager
+def recording(question: str):
+    """Runs the graph against the live backends and yields the fixture being filled."""
+    fixture = {"question": question, "llm": {}, "search": {}}
+    models.set_llm_override(RecordingChatModel(fixture=fixture))
+    search.set_search_override(recording_search(fixture))
+    try:
+        yield fixture
+    finally:
+        models.set_llm_override(None)
+        search.set_search_override(None)
+
+
+@contextmanager
+def replaying(fixture: dict, speed: float = 1.0):
+    """Substitutes fakes serving the fixture for GigaChat and Tavily."""
+    models.set_llm_override(ReplayChatModel(fixture=fixture, speed=speed))
+    search.set_search_override(replay_search(fixture, speed))
+    try:
+        yield
+    finally:
+        models.set_llm_override(None)
+        search.set_search_override(None)
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+import time
+import weakref
+from typing import List
+
+import httpx
+
+from backends import make_backend
+from cache import make_cache
+from telemetry import record_search
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "4"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "20"))
+SEARCH_MAX_QUERIES = int(os.getenv("SEARCH_MAX_QUERIES", "5"))
+
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+
+# Requests per second, in-flight cap, retries and circuit breaker of Tavily (TAVILY_* env);
+# cache hits do not count. An open breaker fails searches at once and the graph goes on without them
+TAVILY_BACKEND = make_backend("TAVILY")
+
+# Search results go stale, so they are not kept forever by default
+SEARCH_CACHE = make_cache(
+    "SEARCH_CACHE", default_path="search_cache.sqlite", default_ttl=3600
+)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def normalize_mode(mode: str) -> str:
+    return "deep" if mode == "deep" else "basic"
+
+
+def cache_key(query: str, mode: str) -> str:
+    return f"{normalize_mode(mode)}:{normalize_query(query)}"
+
+
+def lookup(query: str, mode: str):
+    """Cached Tavily response for the query or None.
+
+    A deep result contains everything a basic one does, so it also serves basic requests.
+    """
+    if SEARCH_CACHE is None:
+        return None
+    modes = ["deep"] if normalize_mode(mode) == "deep" else ["basic", "deep"]
+    return SEARCH_CACHE.get_first(cache_key(query, candidate) for candidate in modes)
+
+
+# Keep-alive connection pool per event loop: httpx clients cannot be shared between loops
+_http_clients = weakref.WeakKeyDictionary()
+
+
+def http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None:
+        client = _http_clients[loop] = httpx.AsyncClient(
+            base_url=TAVILY_BASE_URL,
+            headers={"Authorization": f"Bearer {os.getenv('TAVILY_API_KEY', '')}"},
+            timeout=SEARCH_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=TAVILY_BACKEND.max_in_flight,
+                max_keepalive_connections=TAVILY_BACKEND.max_in_flight,
+            ),
+        )
+    return client
+
+
+async def tavily_search(query: str, mode: str) -> dict:
+    """The Tavily /search request, sent over the shared connection pool."""
+    payload = {"query": query, "max_results": 5}
+    if normalize_mode(mode) == "deep":
+        payload.update(search_depth="advanced", include_raw_content=True)
+    response = await http_client().post("/search", json=payload)
+    response.raise_for_status()
+    result = response.json()
+    result["results"] = result.get("results", [])
+    return result
+
+
+_search_override = None
+
+
+def set_search_override(search_fn):
+    """Replaces the Tavily call with `search_fn(query, mode)`, e.g. for replay. None restores it."""
+    global _search_override
+    _search_override = search_fn
+
+
+# Requests in flight by cache key, so a prefetch and the Searcher share one round trip
+_inflight = {}
+# Prefetched requests by cache key until the Searcher takes them, so a prefetch is
+# not lost when it finishes first and there is no search cache
+SEARCH_PREFETCH_TTL = float(os.getenv("SEARCH_PREFETCH_TTL", "300"))
+_prefetched = {}
+# Keeps prefetch tasks referenced until they finish
+_prefetches = set()
+
+
+async def _fetch(query: str, mode: str) -> dict:
+    response = await TAVILY_BACKEND.call(_search_override or tavily_search, query, mode)
+    if SEARCH_CACHE is not None:
+        SEARCH_CACHE.set(cache_key(query, mode), response)
+    return response
+
+
+def _take_prefetched(key: str):
+    """The prefetch task for the key, if it is still fresh and from this loop."""
+    now = time.monotonic()
+    for other, (_, expires) in list(_prefetched.items()):
+        if expires < now:
+            del _prefetched[other]
+    task, _ = _prefetched.pop(key, (None, None))
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        return None
+    if task.done() and (task.cancelled() or task.exception() is not None):
+        return None
+    return task
+
+
+async def cached_search(query: str, mode: str, prefetching: bool = False):
+    """Returns (response, from_cache). Joining a request already in flight or
+    prefetched counts as cached."""
+    response = lookup(query, mode)
+    if response is not None:
+        return response, True
+
+    key = cache_key(query, mode)
+    task = _inflight.get(key)
+    joined = task is not None and task.get_loop() is asyncio.get_running_loop()
+    if not prefetching:
+        prefetched = _take_prefetched(key)
+        if prefetched is not None:
+            task, joined = prefetched, True
+    if not joined:
+        task = asyncio.ensure_future(_fetch(query, mode))
+        _inflight[key] = task
+        task.add_done_callback(
+            lambda done: _inflight.pop(key) if _inflight.get(key) is done else None
+        )
+    if prefetching and not joined:
+        _prefetched[key] = (task, time.monotonic() + SEARCH_PREFETCH_TTL)
+    # A waiter that times out must not cancel the request for the others
+    return await asyncio.shield(task), joined
+
+
+def prefetch(queries: List[str], mode: str):
+    """Starts the searches in the background; the Searcher node joins them later."""
+    task = asyncio.ensure_future(search_many(queries, mode, prefetching=True))
+    _prefetches.add(task)
+    task.add_done_callback(_prefetches.discard)
+
+
+async def search_many(queries: List[str], mode: str, prefetching: bool = False):
+    """Runs the queries concurrently, bounded by SEARCH_CONCURRENCY and SEARCH_TIMEOUT.
+
+    A failed query does not fail the others. Returns ({query: response},
+    {query: error}, [queries served from cache]). With `prefetching` the
+    responses are also kept for the next search of the same queries.
+    """
+    unique = {}
+    for query in queries:
+        unique.setdefault(normalize_query(query), query)
+    queries = list(unique.values())[:SEARCH_MAX_QUERIES]
+
+    semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+
+    async def run(query):
+        async with semaphore:
+            start = time.perf_counter()
+            response, from_cache = await asyncio.wait_for(
+                cached_search(query, mode, prefetching), SEARCH_TIMEOUT
+            )
+            record_search(
+                query,
+                normalize_mode(mode),
+                time.perf_counter() - start,
+                len(response.get("results", [])),
+                from_cache,
+            )
+            return response, from_cache
+
+    outcomes = await asyncio.gather(
+        *(run(query) for query in queries), return_exceptions=True
+    )
+
+    responses, errors, cached = {}, {}, []
+    for query, outcome in zip(queries, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.warning("Search failed for %r: %r", query, outcome)
+            errors[query] = type(outcome).__name__
+            continue
+        responses[query], from_cache = outcome
+        if from_cache:
+            cached.append(query)
+    return responses, errors, cached
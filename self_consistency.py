@@ -0,0 +1,203 @@
+"""Self-consistency drafts for the tasks the templates flag as weak spots.
+
+For letter counting and arithmetic the answer node can write several drafts at
+once, with varied sampling, and keep one of them: for a letter task the draft
+whose final number matches the letters counted directly in the word, otherwise
+the draft with the most common final number. The critic then reviews only the
+winner, which saves serial answer/critique rounds at the price of parallel tokens.
+
+SELF_CONSISTENCY: off | weak (letter and arithmetic questions only) | always.
+"""
+
+import asyncio
+import os
+import re
+import threading
+from collections import Counter
+from typing import List, Optional
+
+SELF_CONSISTENCY = os.getenv("SELF_CONSISTENCY", "off").lower()
+SELF_CONSISTENCY_K = int(os.getenv("SELF_CONSISTENCY_K", "3"))
+# Drafts generated at once; empty for all of them
+SELF_CONSISTENCY_CONCURRENCY = int(os.getenv("SELF_CONSISTENCY_CONCURRENCY") or 0)
+# Sampling of the extra drafts: temperatures in turn and nucleus top_p. The clients
+# decode greedily (top_p=0), so without top_p the drafts would all be the same.
+# The first draft keeps the model's settings
+SELF_CONSISTENCY_TEMPERATURES = [
+    float(value)
+    for value in os.getenv("SELF_CONSISTENCY_TEMPERATURES", "0.7,1.0").split(",")
+    if value.strip()
+]
+SELF_CONSISTENCY_TOP_P = float(os.getenv("SELF_CONSISTENCY_TOP_P", "0.9"))
+
+# Run name and tag of the drafts, so the UI does not interleave their streams
+SELF_CONSISTENCY_DRAFT_RUN = "self-consistency draft"
+SELF_CONSISTENCY_TAG = "self_consistency"
+
+NUMBER_WORDS = {
+    "ноль": 0,
+    "нуль": 0,
+    "один": 1,
+    "одна": 1,
+    "одно": 1,
+    "одну": 1,
+    "однажды": 1,
+    "два": 2,
+    "две": 2,
+    "дважды": 2,
+    "три": 3,
+    "трижды": 3,
+    "четыре": 4,
+    "пять": 5,
+    "шесть": 6,
+    "семь": 7,
+    "восемь": 8,
+    "девять": 9,
+    "десять": 10,
+    "zero": 0,
+    "one": 1,
+    "once": 1,
+    "two": 2,
+    "twice": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "eight": 8,
+    "nine": 9,
+    "ten": 10,
+}
+
+_LETTER_RE = re.compile(
+    r"(?:букв[аыуе]?|letters?)\s+[\"'«]?(\w)[\"'»]?(?!\w)", re.IGNORECASE
+)
+_WORD_RE = re.compile(
+    r"(?:в\s+слове|in\s+(?:the\s+)?word)\s+[\"'«]?(\w+)[\"'»]?", re.IGNORECASE
+)
+_ARITHMETIC_RE = re.compile(
+    r"\d\s*[-+*/×÷:^]\s*\d|\d.*(?:умнож|раздел|слож|вычт|плюс|минус|процент|"
+    r"степен|корень|sum|times|multipl|divid|plus|minus)",
+    re.IGNORECASE,
+)
+_TOKEN_RE = re.compile(r"-?\d+(?:[.,]\d+)?|\w+")
+
+
+def letter_task(question: str) -> Optional[tuple]:
+    """(letter, word) of a "how many letters X in the word Y" question, or None."""
+    letter, word = _LETTER_RE.search(question), _WORD_RE.search(question)
+    if letter is None or word is None:
+        return None
+    return letter.group(1), word.group(1)
+
+
+def weak_spot(question: str) -> Optional[str]:
+    """Kind of the weak spot the templates warn about (letters, arithmetic) or None."""
+    if letter_task(question) is not None:
+        return "letters"
+    if _ARITHMETIC_RE.search(question):
+        return "arithmetic"
+    return None
+
+
+def draft_count(question: str) -> int:
+    """How many drafts the answer node writes for the question."""
+    if SELF_CONSISTENCY == "always" or (
+        SELF_CONSISTENCY == "weak" and weak_spot(question) is not None
+    ):
+        return max(1, SELF_CONSISTENCY_K)
+    return 1
+
+
+def draft_sampling(index: int) -> dict:
+    """Sampling parameters bound to the draft with this index."""
+    if index == 0:
+        return {}
+    sampling = {"top_p": SELF_CONSISTENCY_TOP_P}
+    temperatures = SELF_CONSISTENCY_TEMPERATURES
+    if temperatures:
+        sampling["temperature"] = temperatures[(index - 1) % len(temperatures)]
+    return sampling
+
+
+def count_letters(letter: str, word: str) -> int:
+    return word.lower().replace("ё", "е").count(letter.lower().replace("ё", "е"))
+
+
+def final_value(text: str) -> Optional[str]:
+    """The last number of the text, written in digits or as a small number word."""
+    for token in reversed(_TOKEN_RE.findall(text.lower())):
+        if token[-1].isdigit():
+            value = float(token.replace(",", "."))
+            return str(int(value)) if value.is_integer() else str(value)
+        if token in NUMBER_WORDS:
+            return str(NUMBER_WORDS[token])
+    return None
+
+
+def select_draft(question: str, drafts: List[str]) -> tuple:
+    """Index of the winning draft and how it was chosen.
+
+    A letter task is checked against the letters counted in the word; the other
+    drafts are put to a majority vote on their final values, ties going to the
+    earlier draft. Without any values the first draft wins.
+    """
+    values = [final_value(draft) for draft in drafts]
+    details = {"drafts": len(drafts), "values": values}
+    task = letter_task(question)
+    if task is not None:
+        expected = str(count_letters(*task))
+        details["expected"] = expected
+        if expected in values:
+            return values.index(expected), dict(details, check="letters")
+    votes = Counter(value for value in values if value is not None)
+    if not votes:
+        return 0, dict(details, check="none")
+    value, count = votes.most_common(1)[0]
+    return values.index(value), dict(details, check="vote", agreement=count)
+
+
+async def gather_drafts(make_draft, count: int) -> List[str]:
+    """Awaits `make_draft(index)` for each draft, SELF_CONSISTENCY_CONCURRENCY at a time."""
+    semaphore = asyncio.Semaphore(SELF_CONSISTENCY_CONCURRENCY or count)
+
+    async def run(index):
+        async with semaphore:
+            return await make_draft(index)
+
+    return list(await asyncio.gather(*(run(index) for index in range(count))))
+
+
+class SelfConsistencyStats:
+    """How often the drafts agreed and how the winners were chosen."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checks = Counter()
+        self.runs = 0
+        self.drafts = 0
+        self.unanimous = 0
+
+    def record(self, details: dict):
+        with self._lock:
+            self.runs += 1
+            self.drafts += details["drafts"]
+            self._checks[details["check"]] += 1
+            values = details["values"]
+            self.unanimous += values[0] is not None and len(set(values)) == 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "drafts": self.drafts,
+                "checks": dict(self._checks),
+                "unanimous_rate": self.unanimous / self.runs if self.runs else 0.0,
+            }
+
+
+SELF_CONSISTENCY_STATS = SelfConsistencyStats()
+
+
+def get_self_consistency_stats() -> dict:
+    return SELF_CONSISTENCY_STATS.as_dict()
@@ -0,0 +1,183 @@
+import asyncio
+import os
+from typing import List, Optional
+
+import aiosqlite
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from context_budget import CHARS_PER_TOKEN, estimate_tokens
+
+# Only the last turns of a conversation are kept, and at most HISTORY_BUDGET tokens of them reach the prompt
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "5"))
+HISTORY_BUDGET = int(os.getenv("HISTORY_BUDGET", "2000"))
+
+
+class SqliteCheckpointer(BaseCheckpointSaver):
+    """AsyncSqliteSaver that works from any event loop.
+
+    AsyncSqliteSaver is bound to the loop it was created in, while Streamlit runs
+    every question in a new loop, so a saver is opened lazily per running loop and
+    savers of closed loops are disposed of.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._savers = {}
+
+    async def _open(self) -> AsyncSqliteSaver:
+        conn = aiosqlite.connect(self.path)
+        # The connection thread of an abandoned loop must not keep the process alive;
+        # SQLite transactions keep the file consistent if it is cut off
+        conn.daemon = True
+        return AsyncSqliteSaver(await conn)
+
+    async def _saver(self) -> AsyncSqliteSaver:
+        loop = asyncio.get_running_loop()
+        if loop not in self._savers:
+            for stale in [other for other in self._savers if other.is_closed()]:
+                task = self._savers.pop(stale)
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    # aiosqlite resolves futures on the caller's loop, so this is safe
+                    await task.result().conn.close()
+            self._savers[loop] = asyncio.ensure_future(self._open())
+        return await self._savers[loop]
+
+    async def aget_tuple(self, config):
+        return await (await self._saver()).aget_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        saver = await self._saver()
+        async for item in saver.alist(
+            config, filter=filter, before=before, limit=limit
+        ):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await (await self._saver()).aput(
+            config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await (await self._saver()).aput_writes(
+            config, writes, task_id, task_path
+        )
+
+    def get_next_version(self, current, channel):
+        return AsyncSqliteSaver.get_next_version(self, current, channel)
+
+
+def make_checkpointer() -> Optional[BaseCheckpointSaver]:
+    """Checkpointer from CHECKPOINTER_BACKEND (`sqlite`, `memory` or `none`)."""
+    backend = os.getenv("CHECKPOINTER_BACKEND", "sqlite").lower()
+    if backend == "sqlite":
+        return SqliteCheckpointer(os.getenv("CHECKPOINTER_PATH", "checkpoints.sqlite"))
+    if backend == "memory":
+        return MemorySaver()
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown CHECKPOINTER_BACKEND: {backend}")
+
+
+def thread_config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _truncate(text: str, tokens: int) -> str:
+    limit = tokens * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def compact_history(messages: List[BaseMessage]):
+    """Renders earlier turns of the conversation for the prompt and bounds the state.
+
+    `messages` ends with the current question. Returns the history text and
+    RemoveMessage updates for intermediate node messages and turns past
+    HISTORY_MAX_TURNS, so the checkpointed state does not grow without limit.
+    """
+    earlier = messages[:-1]
+    turns = []
+    removals = []
+    for message in earlier:
+        if isinstance(message, HumanMessage):
+            turns.append([message])
+        elif isinstance(message, AIMessage) and turns:
+            turns[-1].append(message)
+        elif message.id is not None:
+            removals.append(RemoveMessage(id=message.id))
+
+    stale_turns = turns[:-HISTORY_MAX_TURNS] if HISTORY_MAX_TURNS else turns
+    kept_turns = turns[len(stale_turns) :]
+    removals += [
+        RemoveMessage(id=message.id)
+        for turn in stale_turns
+        for message in turn
+        if message.id is not None
+    ]
+
+    # Newest turns are the most relevant, so they get the budget first
+    parts = []
+    left = HISTORY_BUDGET
+    for turn in reversed(kept_turns):
+        lines = []
+        for message in turn:
+            speaker = (
+                "Пользователь" if isinstance(message, HumanMessage) else "Ассистент"
+            )
+            lines.append(f"{speaker}: {_truncate(str(message.content), left // 2)}")
+        text = "\n".join(lines)
+        if estimate_tokens(text) > left:
+            break
+        parts.append(text)
+        left -= estimate_tokens(text)
+    return "\n\n".join(reversed(parts)), removals
+
+
+async def session_input(
+    runnable, config: dict, message: HumanMessage
+) -> Optional[dict]:
+    """Input for the next run of a thread.
+
+    If the last run stopped midway on the same question, returns None so the graph
+    resumes from the last completed node instead of paying for it again.
+    """
+    snapshot = await runnable.aget_state(config)
+    if snapshot.next:
+        questions = [
+            m
+            for m in snapshot.values.get("messages", [])
+            if isinstance(m, HumanMessage)
+        ]
+        if questions and questions[-1].content == message.content:
+            return None
+    return {"messages": [message]}
+
+
+async def has_history(runnable, config: dict) -> bool:
+    """Whether the thread has completed turns, i.e. the next question is a follow-up."""
+    snapshot = await runnable.aget_state(config)
+    questions = [
+        m for m in snapshot.values.get("messages", []) if isinstance(m, HumanMessage)
+    ]
+    if snapshot.next:
+        # The question of the interrupted run is not a completed turn
+        questions = questions[:-1]
+    return bool(questions)
+
+
+async def record_turn(runnable, config: dict, question: str, answer: str, as_node: str):
+    """Adds a question answered without running the graph to the thread history.
+
+    `as_node` is the last node of the graph, so the thread has nothing left to run.
+    """
+    await runnable.aupdate_state(
+        config,
+        {
+            "messages": [HumanMessage(content=question), AIMessage(content=answer)],
+            "user_question": question,
+        },
+        as_node=as_node,
+    )
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from context_budget import estimate_tokens, tokenize
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_DRAFT = os.getenv("SPECULATIVE_DRAFT", "false").lower() == "true"
+SPECULATIVE_SEARCH = os.getenv("SPECULATIVE_SEARCH", "false").lower() == "true"
+
+# Share of a router query's words that must occur in the question for the
+# speculative search by the question to stand in for that query
+SPECULATIVE_SEARCH_OVERLAP = float(os.getenv("SPECULATIVE_SEARCH_OVERLAP", "0.6"))
+
+# Run name and tag of the speculative draft, so the UI can tell it from the routing call
+SPECULATIVE_DRAFT_RUN = "speculative draft"
+SPECULATIVE_TAG = "speculative"
+
+
+def covered_by(query: str, question: str) -> bool:
+    """Whether a search by the question is as good as one by the router's query.
+
+    Routers write keyword queries, so the words are compared stemmed and unordered.
+    """
+    words = set(tokenize(query))
+    if not words:
+        return False
+    overlap = len(words & set(tokenize(question))) / len(words)
+    return overlap >= SPECULATIVE_SEARCH_OVERLAP
+
+
+class SpeculationStats:
+    """Hit rate and discarded work of speculative tasks, per kind of task."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(
+            lambda: {"started": 0, "hits": 0, "misses": 0, "wasted_tokens": 0}
+        )
+
+    def record(self, kind: str, key: str, value: int = 1):
+        with self._lock:
+            self._stats[kind][key] += value
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            result = {}
+            for kind, stats in self._stats.items():
+                decided = stats["hits"] + stats["misses"]
+                result[kind] = dict(
+                    stats, hit_rate=stats["hits"] / decided if decided else 0.0
+                )
+            return result
+
+
+SPECULATION_STATS = SpeculationStats()
+
+
+def get_speculation_stats() -> dict:
+    return SPECULATION_STATS.as_dict()
+
+
+async def collect_text(runnable, inputs: dict, chunks: list) -> str:
+    """Streams a text chain into `chunks` so partial output is known on cancel."""
+    async for chunk in runnable.astream(inputs):
+        chunks.append(chunk)
+    return "".join(chunks)
+
+
+class Speculation:
+    """Work started before the router decided whether it is needed.
+
+    Call `accept()` to use the result or `discard()` to cancel it; discarded
+    text chunks are counted as wasted tokens. `metadata` is kept for the caller.
+    """
+
+    def __init__(self, kind: str, coro, chunks: list = None, metadata: dict = None):
+        self.kind = kind
+        self.chunks = chunks if chunks is not None else []
+        self.metadata = metadata
+        self.task = asyncio.create_task(coro)
+        SPECULATION_STATS.record(kind, "started")
+
+    async def peek(self):
+        """Waits for the result without deciding whether it is used."""
+        return await self.task
+
+    async def accept(self):
+        result = await self.task
+        SPECULATION_STATS.record(self.kind, "hits")
+        return result
+
+    def discard(self):
+        if self.task.done() and not self.task.cancelled():
+            # Retrieve a possible error so asyncio does not report it as unhandled
+            self.task.exception()
+        self.task.cancel()
+        wasted = estimate_tokens("".join(self.chunks))
+        SPECULATION_STATS.record(self.kind, "misses")
+        SPECULATION_STATS.record(self.kind, "wasted_tokens", wasted)
+        logger.debug("Discarded speculative %s, %d tokens wasted", self.kind, wasted)
@@ -0,0 +1,204 @@
+import inspect
+import json
+import logging
+import os
+import re
+from typing import Awaitable, Callable, Optional, Type
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.utils.json import parse_partial_json
+from pydantic import BaseModel, ValidationError
+
+from context_budget import estimate_prompt_tokens, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+JSON_REPAIR_RETRIES = int(os.getenv("JSON_REPAIR_RETRIES", "1"))
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+REPAIR_TEMPLATE = """Исправь JSON, чтобы он соответствовал схеме. Не меняй смысл значений, выведи только исправленный JSON.
+
+Схема:
+{format_instructions}
+
+Исходный текст:
+{text}
+
+Ошибка разбора:
+{error}"""
+
+REPAIR_PROMPT = ChatPromptTemplate.from_messages([("system", REPAIR_TEMPLATE)])
+
+
+def _json_start(text: str) -> int:
+    return text.find("{")
+
+
+class StreamingJsonParser:
+    """Parses a JSON object incrementally as text chunks arrive.
+
+    A field counts as complete once the next field has started or the object
+    is closed, so its value can be used before the rest is generated. Each chunk
+    is scanned once for string and nesting state, and only a finished top-level
+    member is parsed, so the cost stays linear in the length of the output.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.fields = {}
+        self._started = False
+        self._closed = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Text of the top-level member being generated
+        self._member = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> dict:
+        """Adds a chunk and returns the fields completed by it."""
+        self._chunks.append(chunk)
+        completed = {}
+        if self._closed:
+            return completed
+        position = 0
+        if not self._started:
+            position = chunk.find("{")
+            if position < 0:
+                return completed
+            self._started = True
+            self._depth = 1
+            position += 1
+        member_start = position
+        for i in range(position, len(chunk)):
+            char = chunk[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._member.append(chunk[member_start:i])
+                    self._complete(completed)
+                    self._closed = True
+                    return completed
+            elif char == "," and self._depth == 1:
+                self._member.append(chunk[member_start:i])
+                self._complete(completed)
+                member_start = i + 1
+        self._member.append(chunk[member_start:])
+        return completed
+
+    def _complete(self, completed: dict):
+        member = "".join(self._member).strip()
+        self._member = []
+        if not member:
+            return
+        try:
+            parsed = json.loads("{" + member + "}")
+        except json.JSONDecodeError:
+            # Left to the repair of the whole output
+            return
+        for name, value in parsed.items():
+            if name not in self.fields:
+                self.fields[name] = completed[name] = value
+
+
+def repair_json(text: str) -> Optional[dict]:
+    """Local fixes for common model mistakes: code fences, prose around the object,
+    trailing commas and unclosed brackets."""
+    start = _json_start(text)
+    if start < 0:
+        return None
+    text = text[start:]
+    end = text.rfind("}")
+    candidates = [text[: end + 1]] if end >= 0 else []
+    candidates.append(text)
+    for candidate in candidates:
+        candidate = _TRAILING_COMMA_RE.sub(r"\1", candidate)
+        try:
+            parsed = parse_partial_json(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict):
+            return parsed
+    return None
+
+
+async def _call(callback, *args):
+    result = callback(*args)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def astream_structured(
+    chain,
+    inputs: dict,
+    model_cls: Type[BaseModel],
+    llm=None,
+    on_field: Optional[Callable[[str, object], Optional[Awaitable]]] = None,
+    stats: Optional[dict] = None,
+) -> BaseModel:
+    """Streams `chain` (a prompt | llm text chain) and parses its JSON into `model_cls`.
+
+    `on_field(name, value)` is called as soon as each top-level field is complete.
+    Malformed output is repaired locally first and then, if `llm` is given, by a
+    short repair call that sees only the broken output, not the original prompt.
+    The estimated tokens of the repair calls are added to `stats["repair_tokens"]`.
+    """
+    parser = StreamingJsonParser()
+    async for chunk in chain.astream(inputs):
+        completed = parser.feed(chunk)
+        if on_field is not None:
+            for name, value in completed.items():
+                await _call(on_field, name, value)
+
+    text = parser.text
+    error = None
+    for attempt in range(JSON_REPAIR_RETRIES + 1):
+        data = repair_json(text)
+        if data is not None:
+            try:
+                return model_cls.model_validate(data)
+            except ValidationError as e:
+                error = e
+        else:
+            error = ValueError("no JSON object in the output")
+
+        if llm is None or attempt == JSON_REPAIR_RETRIES:
+            break
+        logger.warning("Repairing %s output: %s", model_cls.__name__, error)
+        format_instructions = PydanticOutputParser(
+            pydantic_object=model_cls
+        ).get_format_instructions()
+        repair_inputs = {
+            "format_instructions": format_instructions,
+            "text": text,
+            "error": str(error),
+        }
+        repair_chain = REPAIR_PROMPT | llm | StrOutputParser()
+        text = await repair_chain.ainvoke(repair_inputs)
+        if stats is not None:
+            stats["repair_tokens"] = (
+                stats.get("repair_tokens", 0)
+                + estimate_prompt_tokens(REPAIR_PROMPT, repair_inputs)
+                + estimate_tokens(text)
+            )
+
+    raise OutputParserException(
+        f"Could not parse {model_cls.__name__} from model output: {error}"
+    )
@@ -0,0 +1,346 @@
+"""Per-node telemetry of graph runs.
+
+With TELEMETRY=true every node is wrapped by `instrument()`. The wrapper records
+node wall time and the route of Command-returning nodes, and attaches a callback
+handler to the LLM calls made inside the node (time to first token, tokens/sec,
+prompt and completion tokens). Searches are reported through `record_search()`.
+
+Each run becomes a JSON trace, and aggregates are kept as Prometheus histograms.
+With TELEMETRY_PORT set, both are served on localhost: /metrics, /traces and
+/traces/<trace_id>. When telemetry is off, nodes are not wrapped at all.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+from langgraph.types import Command
+
+from context_budget import estimate_tokens
+
+TELEMETRY_ENABLED = os.getenv("TELEMETRY", "false").lower() == "true"
+TELEMETRY_PORT = int(os.getenv("TELEMETRY_PORT") or 0)
+TELEMETRY_MAX_TRACES = int(os.getenv("TELEMETRY_MAX_TRACES", "200"))
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (5, 10, 20, 40, 80, 160)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+TOKEN_BUCKETS = (100, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = defaultdict(lambda: [[0] * len(buckets), 0, 0.0])
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, _, _ = series = self._series[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key, (counts, count, total) in self._series.items():
+                labels = ",".join(f'{k}="{v}"' for k, v in key)
+                sep = "," if labels else ""
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(
+                        f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {bucket_count}'
+                    )
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {count}')
+                lines.append(f"{self.name}_count{{{labels}}} {count}")
+                lines.append(f"{self.name}_sum{{{labels}}} {total}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] += value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in self._values.items():
+                labels = ",".join(f'{k}="{v}"' for k, v in key)
+                lines.append(f"{self.name}{{{labels}}} {value}")
+        return "\n".join(lines)
+
+
+NODE_SECONDS = Histogram("reasoner_node_seconds", "Node wall time", LATENCY_BUCKETS)
+LLM_TTFT_SECONDS = Histogram(
+    "reasoner_llm_ttft_seconds", "LLM time to first token", LATENCY_BUCKETS
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "reasoner_llm_tokens_per_second", "LLM generation speed", RATE_BUCKETS
+)
+LLM_PROMPT_TOKENS = Histogram(
+    "reasoner_llm_prompt_tokens", "Prompt tokens per LLM call", TOKEN_BUCKETS
+)
+LLM_COMPLETION_TOKENS = Histogram(
+    "reasoner_llm_completion_tokens", "Completion tokens per LLM call", TOKEN_BUCKETS
+)
+SEARCH_SECONDS = Histogram("reasoner_search_seconds", "Search latency", LATENCY_BUCKETS)
+SEARCH_RESULTS = Histogram(
+    "reasoner_search_results", "Results per search", SIZE_BUCKETS
+)
+ROUTES = Counter("reasoner_routes_total", "Routes chosen by routing nodes")
+LOOP_ITERATIONS = Counter(
+    "reasoner_node_runs_total", "Node runs, e.g. critique iterations"
+)
+
+METRICS = [
+    NODE_SECONDS,
+    LLM_TTFT_SECONDS,
+    LLM_TOKENS_PER_SECOND,
+    LLM_PROMPT_TOKENS,
+    LLM_COMPLETION_TOKENS,
+    SEARCH_SECONDS,
+    SEARCH_RESULTS,
+    ROUTES,
+    LOOP_ITERATIONS,
+]
+
+_traces = OrderedDict()
+_traces_lock = threading.Lock()
+
+
+class NodeTelemetry(BaseCallbackHandler):
+    """Callback handler collecting the LLM calls and searches of one node run."""
+
+    run_inline = True
+
+    def __init__(self, node: str):
+        self.node = node
+        self.llm_calls = []
+        self.searches = []
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        prompt_tokens = sum(
+            estimate_tokens(str(message.content))
+            for batch in messages
+            for message in batch
+        )
+        self._runs[run_id] = {
+            "start": time.perf_counter(),
+            "first_token": None,
+            "prompt_tokens": prompt_tokens,
+        }
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and run["first_token"] is None and token:
+            run["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        end = time.perf_counter()
+        text = "".join(
+            g.text for generations in response.generations for g in generations
+        )
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        completion_tokens = token_usage.get("completion_tokens", estimate_tokens(text))
+        first_token = run["first_token"] or end
+        call = {
+            "latency": end - run["start"],
+            "ttft": first_token - run["start"],
+            "prompt_tokens": token_usage.get("prompt_tokens", run["prompt_tokens"]),
+            "completion_tokens": completion_tokens,
+            "tokens_per_second": (
+                completion_tokens / (end - first_token) if end > first_token else None
+            ),
+        }
+        self.llm_calls.append(call)
+        LLM_TTFT_SECONDS.observe(call["ttft"], node=self.node)
+        LLM_PROMPT_TOKENS.observe(call["prompt_tokens"], node=self.node)
+        LLM_COMPLETION_TOKENS.observe(completion_tokens, node=self.node)
+        if call["tokens_per_second"] is not None:
+            LLM_TOKENS_PER_SECOND.observe(call["tokens_per_second"], node=self.node)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+
+_current = ContextVar("reasoner_node_telemetry", default=None)
+# Every run configured while a node is instrumented gets its handler
+register_configure_hook(_current, inheritable=True)
+
+
+def record_search(query: str, mode: str, latency: float, results: int, cached: bool):
+    """Reports a search made by the current node; a no-op outside instrumented nodes."""
+    telemetry = _current.get()
+    if telemetry is None:
+        return
+    telemetry.searches.append(
+        {
+            "query": query,
+            "mode": mode,
+            "latency": latency,
+            "results": results,
+            "cached": cached,
+        }
+    )
+    SEARCH_SECONDS.observe(latency, mode=mode, cached=str(cached).lower())
+    SEARCH_RESULTS.observe(results, mode=mode)
+
+
+def _store_span(trace_id: str, span: dict, question: Optional[str]):
+    with _traces_lock:
+        trace = _traces.get(trace_id)
+        if trace is None:
+            trace = _traces[trace_id] = {
+                "trace_id": trace_id,
+                "question": question,
+                "started": time.time(),
+                "nodes": [],
+            }
+            while len(_traces) > TELEMETRY_MAX_TRACES:
+                _traces.popitem(last=False)
+        elif trace["question"] is None:
+            trace["question"] = question
+        trace["nodes"].append(span)
+
+
+def instrument(node: str, fn, starts_trace: bool = False):
+    """Wraps an async node with telemetry; returns `fn` itself when telemetry is off.
+
+    The trace id lives in the graph state, so a run resumed from a checkpoint
+    keeps its trace. `starts_trace` marks the entry node, which opens a new one.
+    """
+    if not TELEMETRY_ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    async def wrapper(state):
+        trace_id = state.get("trace_id")
+        if starts_trace or not trace_id:
+            trace_id = uuid.uuid4().hex
+        telemetry = NodeTelemetry(node)
+        token = _current.set(telemetry)
+        start = time.perf_counter()
+        try:
+            result = await fn(state)
+        finally:
+            _current.reset(token)
+            wall = time.perf_counter() - start
+            NODE_SECONDS.observe(wall, node=node)
+            LOOP_ITERATIONS.inc(node=node)
+
+        span = {
+            "node": node,
+            "wall": wall,
+            "llm": telemetry.llm_calls,
+            "search": telemetry.searches,
+        }
+        if isinstance(result, Command):
+            span["route"] = result.goto
+            ROUTES.inc(node=node, route=result.goto)
+        if starts_trace:
+            # The entry node sets user_question itself, so it gets the new message
+            messages = state.get("messages") or []
+            question = messages[-1].content if messages else None
+        else:
+            question = state.get("user_question")
+        _store_span(trace_id, span, question or None)
+
+        if starts_trace:
+            if isinstance(result, Command):
+                result.update["trace_id"] = trace_id
+            else:
+                result["trace_id"] = trace_id
+        return result
+
+    return wrapper
+
+
+def get_trace(trace_id: str) -> Optional[dict]:
+    with _traces_lock:
+        trace = _traces.get(trace_id)
+        return json.loads(json.dumps(trace)) if trace is not None else None
+
+
+def recent_traces() -> list:
+    with _traces_lock:
+        return json.loads(json.dumps(list(_traces.values())))
+
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = render_metrics(), "text/plain; version=0.0.4"
+        elif self.path == "/traces":
+            body, content_type = (
+                json.dumps(recent_traces(), ensure_ascii=False),
+                "application/json",
+            )
+        elif self.path.startswith("/traces/"):
+            trace = get_trace(self.path[len("/traces/") :])
+            if trace is None:
+                self.send_error(404)
+                return
+            body, content_type = (
+                json.dumps(trace, ensure_ascii=False),
+                "application/json",
+            )
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_server(port: int = TELEMETRY_PORT):
+    """Serves metrics and traces on localhost in a daemon thread; idempotent."""
+    global _server
+    if _server is not None or not port:
+        return _server
+    _server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server